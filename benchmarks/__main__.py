@@ -0,0 +1,60 @@
+"""Runs the pipeline benchmarks from the repository root, for example
+
+    python -m benchmarks --durations 600 1800 3600 --output results.json
+    python -m benchmarks --output new.json --compare results.json
+"""
+import argparse
+import sys
+
+from benchmarks.pipeline import DEFAULT_DRIVE_COUNT
+from benchmarks.pipeline import DEFAULT_DURATIONS
+from benchmarks.pipeline import DEFAULT_REGRESSION_RATIO
+from benchmarks.pipeline import DEFAULT_REPEATS
+from benchmarks.pipeline import DEFAULT_SEED
+from benchmarks.pipeline import compare_results
+from benchmarks.pipeline import load_results
+from benchmarks.pipeline import print_comparison
+from benchmarks.pipeline import print_scaling
+from benchmarks.pipeline import run_benchmarks
+from benchmarks.pipeline import save_results
+from benchmarks.pipeline import unmatched_runs
+from benchmarks.synthetic import DEFAULT_GPS_RATE
+from benchmarks.synthetic import DEFAULT_OBD_RATE
+from util import OBDModes
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description='Times every stage of the pipeline on synthetic drives')
+    parser.add_argument('--modes', nargs='+', choices=[mode.name for mode in OBDModes],
+                        default=[mode.name for mode in OBDModes], help='the OBD modes of the drives')
+    parser.add_argument('--durations', nargs='+', type=int, default=list(DEFAULT_DURATIONS),
+                        help='the lengths of the drives in seconds, one run per length')
+    parser.add_argument('--drives', type=int, default=DEFAULT_DRIVE_COUNT, help='the number of drives of every run')
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS, help='the number of times every stage is timed')
+    parser.add_argument('--gps-rate', type=float, default=DEFAULT_GPS_RATE, help='GPS fixes per second')
+    parser.add_argument('--obd-rate', type=float, default=DEFAULT_OBD_RATE, help='OBD calls per second')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='the seed of the drives and the centers')
+    parser.add_argument('--work-dir', help='keep the generated files in this directory')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--compare', help='compare the results to those saved in this JSON file')
+    parser.add_argument('--regression-ratio', type=float, default=DEFAULT_REGRESSION_RATIO,
+                        help='a stage this many times slower than in --compare fails the run, as does a --compare '
+                             'without any of the runs')
+    args = parser.parse_args(arguments)
+    results = run_benchmarks(obd_modes=[OBDModes[mode].value for mode in args.modes], durations=args.durations,
+                             drive_count=args.drives, repeats=args.repeats, gps_rate=args.gps_rate,
+                             obd_rate=args.obd_rate, seed=args.seed, work_dir_path=args.work_dir)
+    print_scaling(results)
+    if args.output:
+        save_results(results, args.output)
+    if args.compare:
+        baseline = load_results(args.compare)
+        comparison = compare_results(baseline, results, regression_ratio=args.regression_ratio)
+        print_comparison(comparison, unmatched_runs(baseline, results))
+        return 1 if not comparison or any(row[-1] for row in comparison) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,327 @@
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from csv import writer
+
+import numpy as np
+
+from benchmarks.synthetic import DEFAULT_GPS_RATE
+from benchmarks.synthetic import DEFAULT_OBD_RATE
+from benchmarks.synthetic import generate_drive_dir
+from csv_util import combine_drive_files
+from csv_util import load_file_gps_points
+from data_converter import drive_csv_to_separate_coordinates
+from gps_normalizer import normalize
+from model import cheapest_path_model
+from model import generate_drive_model
+from spatial_index import CentersIndex
+from util import Headers
+from util import OBDModes
+from util import calculate_route_length
+
+RESULTS_VERSION = 1
+STAGES = ('combine_drive_files', 'calculate_route_length', 'normalize', 'generate_drive_model',
+          'cheapest_path_model', 'drive_csv_to_separate_coordinates')
+DEFAULT_DURATIONS = (300, 900, 2700)  # s, the drive lengths of the scaling curve
+DEFAULT_DRIVE_COUNT = 4
+DEFAULT_REPEATS = 3
+DEFAULT_SEED = 0
+DEFAULT_DISTANCE_BETWEEN_POINTS = 0.1  # km
+DEFAULT_ITERATION_COUNT = 3
+DEFAULT_REGRESSION_RATIO = 1.25  # A stage this many times slower than the baseline is a regression
+
+
+def run_benchmarks(obd_modes=tuple(mode.value for mode in OBDModes), durations=DEFAULT_DURATIONS,
+                   drive_count=DEFAULT_DRIVE_COUNT, repeats=DEFAULT_REPEATS, gps_rate=DEFAULT_GPS_RATE,
+                   obd_rate=DEFAULT_OBD_RATE, seed=DEFAULT_SEED, work_dir_path=None, print_logs=True):
+    """Times every stage of the pipeline on synthetic drives of every OBD mode and every length
+
+    Every run generates `drive_count` drives along one route with `benchmarks.synthetic.generate_drive_dir()` and
+    passes them through the stages in order, each stage getting the output of the one before it:
+
+    - combine_drive_files, every GPS and OBD pair into a drive file
+    - calculate_route_length, of the GPS points of every drive
+    - normalize, the GPS points of all the drives into centers DEFAULT_DISTANCE_BETWEEN_POINTS km apart
+    - generate_drive_model, of every drive file, with one centers index for all of them
+    - cheapest_path_model, over the driving models
+    - drive_csv_to_separate_coordinates, of every drive file, without copying the result
+
+    Parameters
+    ----------
+    obd_modes : Iterable[OBDModes enum value], optional
+        The OBD modes of the drives (the default is every mode)
+    durations : Iterable[int], optional
+        The lengths of the drives in seconds, one run per length (the default is DEFAULT_DURATIONS)
+    drive_count : int, optional
+        The number of drives of every run (the default is DEFAULT_DRIVE_COUNT)
+    repeats : int, optional
+        The number of times every stage is timed, the fastest time is reported (the default is DEFAULT_REPEATS)
+    gps_rate, obd_rate : float, optional
+        As `benchmarks.synthetic.generate_drive_files()` takes them
+    seed : int, optional
+        The seed of the drives and of the initial centers, so runs on different commits time the same work (the
+        default is DEFAULT_SEED)
+    work_dir_path : str, optional
+        A directory for the generated files, which are kept (the default is a temporary directory, which is removed)
+    print_logs : bool, optional
+        Print every stage time (the default is True)
+
+    Returns
+    ----------
+    dict
+        The results, as `save_results()` saves them
+    """
+    runs = []
+    with contextlib.ExitStack() as stack:
+        if work_dir_path is None:
+            work_dir_path = stack.enter_context(tempfile.TemporaryDirectory())
+        for obd_mode in obd_modes:
+            for duration in durations:
+                run_dir_path = os.path.join(work_dir_path, OBDModes(obd_mode).name + ' ' + str(duration))
+                runs.append(run_pipeline(run_dir_path, obd_mode, duration, drive_count=drive_count, repeats=repeats,
+                                         gps_rate=gps_rate, obd_rate=obd_rate, seed=seed))
+                if print_logs:
+                    __print_run(runs[-1])
+    return {'version': RESULTS_VERSION, 'environment': benchmark_environment(),
+            'parameters': {'obd_modes': [OBDModes(obd_mode).name for obd_mode in obd_modes],
+                           'durations': list(durations), 'drive_count': drive_count, 'repeats': repeats,
+                           'gps_rate': gps_rate, 'obd_rate': obd_rate, 'seed': seed},
+            'runs': runs, 'scaling': scaling_exponents(runs)}
+
+
+def run_pipeline(run_dir_path, obd_mode, duration, drive_count=DEFAULT_DRIVE_COUNT, repeats=DEFAULT_REPEATS,
+                 gps_rate=DEFAULT_GPS_RATE, obd_rate=DEFAULT_OBD_RATE, seed=DEFAULT_SEED):
+    """Generates the drives of a single run and times every stage on them, see `run_benchmarks()`
+
+    Returns
+    ----------
+    dict
+        The OBD mode, the drive length, the number of GPS and OBD rows, and the fastest time, every time and the rows
+        per second of every stage
+    """
+    input_dir_path = os.path.join(run_dir_path, 'input')
+    drives_dir_path = os.path.join(run_dir_path, 'drives')
+    models_dir_path = os.path.join(run_dir_path, 'models')
+    os.makedirs(drives_dir_path, exist_ok=True)
+    os.makedirs(models_dir_path, exist_ok=True)
+    file_pairs = generate_drive_dir(input_dir_path, drive_count, obd_mode, duration, gps_rate=gps_rate,
+                                    obd_rate=obd_rate, seed=seed)
+    drive_paths = [os.path.join(drives_dir_path, os.path.basename(gps_path).replace('GPS ', ''))
+                   for gps_path, _ in file_pairs]
+    model_paths = [os.path.join(models_dir_path, os.path.basename(drive_path)) for drive_path in drive_paths]
+    gps_row_count = sum(__line_count(gps_path) for gps_path, _ in file_pairs)
+    obd_row_count = sum(__line_count(obd_path) for _, obd_path in file_pairs)
+    stages = {}
+
+    def combine():
+        return [combine_drive_files(gps_path, obd_path, obd_mode) for gps_path, obd_path in file_pairs]
+
+    stages['combine_drive_files'], drives = __time_stage(combine, repeats, gps_row_count + obd_row_count)
+    for drive_path, drive in zip(drive_paths, drives):
+        with open(drive_path, 'w', newline='') as file:
+            csv_writer = writer(file)
+            csv_writer.writerow(Headers[obd_mode])
+            csv_writer.writerows(drive)
+
+    drives_points = [load_file_gps_points(drive_path) for drive_path in drive_paths]
+    stages['calculate_route_length'], route_lengths = __time_stage(
+        lambda: [calculate_route_length(points) for points in drives_points], repeats, gps_row_count)
+
+    all_points = [point for points in drives_points for point in points]
+
+    def normalize_points():
+        random.seed(seed)  # normalize() picks the initial centers with the random module
+        return normalize(all_points, min(route_lengths), DEFAULT_DISTANCE_BETWEEN_POINTS, DEFAULT_ITERATION_COUNT,
+                         print_logs=False)
+
+    stages['normalize'], centers_list = __time_stage(normalize_points, repeats, len(all_points))
+
+    centers_index = CentersIndex(centers_list)
+    stages['generate_drive_model'], _ = __time_stage(
+        lambda: [generate_drive_model(drive_path, centers_list, model_save_path=model_path,
+                                      centers_index=centers_index)
+                 for drive_path, model_path in zip(drive_paths, model_paths)], repeats, gps_row_count)
+
+    model_row_count = sum(__line_count(model_path) for model_path in model_paths)
+    with contextlib.redirect_stdout(io.StringIO()):  # cheapest_path_model() prints the route
+        stages['cheapest_path_model'], _ = __time_stage(lambda: cheapest_path_model(models_dir_path), repeats,
+                                                        model_row_count)
+
+    stages['drive_csv_to_separate_coordinates'], _ = __time_stage(
+        lambda: [drive_csv_to_separate_coordinates(drive_path, copy_result=False) for drive_path in drive_paths],
+        repeats, gps_row_count)
+    return {'obd_mode': OBDModes(obd_mode).name, 'duration': duration, 'drive_count': drive_count,
+            'gps_rows': gps_row_count, 'obd_rows': obd_row_count, 'centers': len(centers_list),
+            'model_rows': model_row_count, 'stages': stages}
+
+
+def scaling_exponents(runs):
+    """The exponent `b` of the fit `seconds = a * rows ** b` of every stage of every OBD mode, 1 is linear scaling
+
+    Parameters
+    ----------
+    runs : List[dict]
+        The runs, as `run_pipeline()` returns them
+
+    Returns
+    ----------
+    Dict[str, Dict[str, float]]
+        The exponent of every stage by the OBD mode name, for modes with runs of at least two sizes
+    """
+    exponents = {}
+    for obd_mode in dict.fromkeys(run['obd_mode'] for run in runs):
+        mode_runs = [run for run in runs if run['obd_mode'] == obd_mode]
+        for stage in STAGES:
+            rows = np.array([run['stages'][stage]['rows'] for run in mode_runs], dtype=np.float64)
+            seconds = np.array([run['stages'][stage]['seconds'] for run in mode_runs], dtype=np.float64)
+            valid = (rows > 0) & (seconds > 0)
+            if len(np.unique(rows[valid])) < 2:
+                continue
+            exponents.setdefault(obd_mode, {})[stage] = \
+                round(float(np.polyfit(np.log(rows[valid]), np.log(seconds[valid]), 1)[0]), 3)
+    return exponents
+
+
+def benchmark_environment():
+    """The commit, the interpreter, numpy and the machine the benchmarks run on, to tell results apart"""
+    repository_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return {'commit': __git_output(repository_path, 'rev-parse', 'HEAD'),
+            'dirty': bool(__git_output(repository_path, 'status', '--porcelain', '--untracked-files=no')),
+            'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(), 'cpu_count': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+
+
+def save_results(results, output_path):
+    """Saves benchmark results to a JSON file"""
+    with open(output_path, 'w') as file:
+        json.dump(results, file, indent=2)
+
+
+def load_results(input_path):
+    """Loads benchmark results saved by `save_results()`"""
+    with open(input_path, 'r') as file:
+        results = json.load(file)
+    if results.get('version') != RESULTS_VERSION:
+        raise ValueError(input_path + ' has results version ' + str(results.get('version')) + ', only version ' +
+                         str(RESULTS_VERSION) + ' is supported')
+    return results
+
+
+def compare_results(baseline, current, regression_ratio=DEFAULT_REGRESSION_RATIO):
+    """Compares the stage times of two benchmark results, stage by stage, for the runs both of them have
+
+    Parameters
+    ----------
+    baseline : dict
+        The earlier results, as `load_results()` loads them
+    current : dict
+        The later results
+    regression_ratio : float, optional
+        A stage whose time grew by more than this ratio is a regression (the default is DEFAULT_REGRESSION_RATIO)
+
+    Returns
+    ----------
+    List[(str, int, str, float, float, float, bool)]
+        The OBD mode name, drive length, stage, baseline seconds, current seconds, their ratio and whether it's a
+        regression, of every stage of every shared run
+    """
+    baseline_runs = {(run['obd_mode'], run['duration'], run['drive_count']): run for run in baseline['runs']}
+    comparison = []
+    for run in current['runs']:
+        baseline_run = baseline_runs.get((run['obd_mode'], run['duration'], run['drive_count']))
+        if baseline_run is None:
+            continue
+        for stage in STAGES:
+            if stage not in baseline_run['stages'] or stage not in run['stages']:
+                continue
+            baseline_seconds = baseline_run['stages'][stage]['seconds']
+            current_seconds = run['stages'][stage]['seconds']
+            ratio = current_seconds / baseline_seconds if baseline_seconds else float('inf')
+            comparison.append((run['obd_mode'], run['duration'], stage, baseline_seconds, current_seconds, ratio,
+                               ratio > regression_ratio))
+    return comparison
+
+
+def unmatched_runs(baseline, current):
+    """The runs of two benchmark results which the other one doesn't have, and so `compare_results()` skips
+
+    Parameters
+    ----------
+    baseline : dict
+        The earlier results, as `load_results()` loads them
+    current : dict
+        The later results
+
+    Returns
+    ----------
+    List[(str, str, int, int)]
+        'baseline' or 'current', the results the run is in, and the OBD mode name, drive length and drive count of the
+        run
+    """
+    baseline_keys = [(run['obd_mode'], run['duration'], run['drive_count']) for run in baseline['runs']]
+    current_keys = [(run['obd_mode'], run['duration'], run['drive_count']) for run in current['runs']]
+    return [('baseline',) + key for key in baseline_keys if key not in current_keys] + \
+        [('current',) + key for key in current_keys if key not in baseline_keys]
+
+
+def print_comparison(comparison, unmatched=()):
+    """Prints the comparison of `compare_results()` as a table, marking the regressions, and the runs of
+    `unmatched_runs()` which weren't compared"""
+    if comparison:
+        print('{:<6}{:>8}  {:<36}{:>11}{:>11}{:>8}'.format('Mode', 'Length', 'Stage', 'Baseline', 'Current', 'Ratio'))
+    else:
+        print('No run was compared, the results have no run with the same OBD mode, length and drive count')
+    for obd_mode, duration, stage, baseline_seconds, current_seconds, ratio, regression in comparison:
+        print('{:<6}{:>8}  {:<36}{:>11.4f}{:>11.4f}{:>8.2f}'.format(obd_mode, duration, stage, baseline_seconds,
+                                                                    current_seconds, ratio) +
+              ('  slower' if regression else ''))
+    for side, obd_mode, duration, drive_count in unmatched:
+        print('Only in the ' + side + ' results, not compared: ' + obd_mode + ', ' + str(drive_count) +
+              ' drives of ' + str(duration) + ' seconds')
+
+
+def print_scaling(results):
+    """Prints the scaling exponents of every stage of every OBD mode"""
+    print('Scaling exponents, seconds ~ rows ** b')
+    for obd_mode, exponents in results['scaling'].items():
+        print(obd_mode + ': ' + ', '.join(stage + ' ' + str(exponent) for stage, exponent in exponents.items()))
+
+
+def __time_stage(function, repeats, rows):
+    """Runs a stage `repeats` times and returns its timing and the result of the last run"""
+    runs = []
+    result = None
+    for _ in range(max(repeats, 1)):
+        start_time = time.perf_counter()
+        result = function()
+        runs.append(time.perf_counter() - start_time)
+    seconds = min(runs)
+    return {'seconds': seconds, 'runs': runs, 'rows': rows, 'rows_per_second': rows / seconds if seconds else None}, \
+        result
+
+
+def __print_run(run):
+    print(run['obd_mode'] + ', ' + str(run['drive_count']) + ' drives of ' + str(run['duration']) + ' seconds, ' +
+          str(run['gps_rows']) + ' GPS rows, ' + str(run['obd_rows']) + ' OBD rows')
+    for stage, timing in run['stages'].items():
+        print('    {:<36}{:>10.4f} s{:>14.0f} rows/s'.format(stage, timing['seconds'], timing['rows_per_second'] or 0))
+
+
+def __line_count(path):
+    with open(path, 'rb') as file:
+        return sum(1 for _ in file)
+
+
+def __git_output(repository_path, *arguments):
+    try:
+        return subprocess.run(('git',) + arguments, cwd=repository_path, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
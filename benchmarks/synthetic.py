@@ -0,0 +1,217 @@
+import csv
+import os
+
+import numpy as np
+
+from geodesic import EARTH_RADIUS
+from util import CommandNames
+from util import FROM_HOME_START_TUPLE
+from util import OBDModes
+
+ROUTE_STEP = 10  # m between two points of a route
+TURN_PROBABILITY = 0.005  # The chance of a right angle turn at every route point
+DEFAULT_START_TIME = 1600000000000  # ms
+DEFAULT_GPS_RATE = 1  # GPS fixes per second, the rate of the app
+DEFAULT_OBD_RATE = 4  # OBD calls per second, of all the commands together
+DEFAULT_GPS_NOISE = 3  # m, the standard deviation of the GPS error
+SPEED_TARGETS = (0, 30, 50, 70, 90)  # km/h, the speeds a drive switches between
+MIN_SPEED_DURATION = 20  # s
+MAX_SPEED_DURATION = 120  # s
+ACCELERATION = 2.5  # m/s^2
+DECELERATION = 3.5  # m/s^2
+KMH_TO_MS = 1 / 3.6
+
+# The commands the app calls in every OBD mode, in the order it calls them
+MODE_COMMANDS = {
+    OBDModes.RPM.value: (CommandNames.ENGINE_RPM, CommandNames.INTAKE_MANIFOLD_PRESSURE,
+                         CommandNames.AIR_INTAKE_TEMP, CommandNames.SPEED),
+    OBDModes.MAF.value: (CommandNames.MAF, CommandNames.SPEED),
+    OBDModes.FUEL.value: (CommandNames.FUEL_CONSUMPTION_RATE, CommandNames.SPEED)
+}
+
+
+def generate_route(length, start=FROM_HOME_START_TUPLE, seed=None):
+    """A random road, which mostly bends gently and now and then turns at a right angle
+
+    Parameters
+    ----------
+    length : float
+        The length of the route in meters
+    start : (float, float), optional
+        The latlong tuple the route starts at (the default is util.FROM_HOME_START_TUPLE)
+    seed : int, optional
+        The seed of the random choices, for repeatable routes (the default is a random seed)
+
+    Returns
+    ----------
+    numpy.ndarray
+        The (n, 2) latlongs of the route, ROUTE_STEP meters apart
+    """
+    rng = np.random.default_rng(seed)
+    count = int(np.ceil(length / ROUTE_STEP)) + 1
+    turns = rng.normal(0, 0.02, count) + np.where(rng.random(count) < TURN_PROBABILITY,
+                                                  rng.choice((-np.pi / 2, np.pi / 2), count), 0)
+    headings = rng.uniform(0, 2 * np.pi) + np.cumsum(turns)
+    north = np.concatenate(([0], np.cumsum(np.cos(headings[:-1]) * ROUTE_STEP)))
+    east = np.concatenate(([0], np.cumsum(np.sin(headings[:-1]) * ROUTE_STEP)))
+    return np.column_stack((start[0] + np.degrees(north / EARTH_RADIUS),
+                            start[1] + np.degrees(east / (EARTH_RADIUS * np.cos(np.radians(start[0]))))))
+
+
+def generate_speed_profile(duration, seed=None):
+    """The speed of a drive every second, which accelerates and brakes between random speeds and stops
+
+    Parameters
+    ----------
+    duration : int
+        The length of the drive in seconds
+    seed : int, optional
+        The seed of the random choices (the default is a random seed)
+
+    Returns
+    ----------
+    numpy.ndarray
+        The speed in km/h at every second, `duration` + 1 speeds
+    """
+    rng = np.random.default_rng(seed)
+    speeds = np.zeros(duration + 1)
+    target = 0
+    target_end = 0
+    for second in range(1, duration + 1):
+        if second >= target_end:
+            target = rng.choice(SPEED_TARGETS[1:]) if target == 0 else rng.choice(SPEED_TARGETS)
+            target_end = second + rng.integers(MIN_SPEED_DURATION, MAX_SPEED_DURATION + 1)
+        change = target - speeds[second - 1]
+        speeds[second] = speeds[second - 1] + np.clip(change, -DECELERATION / KMH_TO_MS, ACCELERATION / KMH_TO_MS)
+    return speeds
+
+
+def generate_drive_files(gps_output_path, obd_output_path, obd_mode, duration, route=None,
+                         gps_rate=DEFAULT_GPS_RATE, obd_rate=DEFAULT_OBD_RATE, gps_noise=DEFAULT_GPS_NOISE,
+                         start_time=DEFAULT_START_TIME, seed=None):
+    """Writes a GPS and OBD file pair of a drive, in the format of the app
+
+    The car drives along `route` with the speeds of `generate_speed_profile()`, the GPS fixes are its positions with a
+    random error, and the OBD calls go over the commands of `obd_mode` in turn, with values that follow the speed
+
+    Parameters
+    ----------
+    gps_output_path : str
+        The path of the GPS file
+    obd_output_path : str
+        The path of the OBD file
+    obd_mode : OBDModes enum value
+        The OBD mode, which sets the commands in the OBD file
+    duration : int
+        The length of the drive in seconds
+    route : numpy.ndarray, optional
+        The route, as `generate_route()` returns it, it's extended by a straight line if the drive is longer (the
+        default is a new route from `seed`)
+    gps_rate : float, optional
+        GPS fixes per second (the default is DEFAULT_GPS_RATE)
+    obd_rate : float, optional
+        OBD calls per second, of all the commands together (the default is DEFAULT_OBD_RATE)
+    gps_noise : float, optional
+        The standard deviation of the GPS error in meters (the default is DEFAULT_GPS_NOISE)
+    start_time : int, optional
+        The time of the first GPS fix in milliseconds (the default is DEFAULT_START_TIME)
+    seed : int, optional
+        The seed of the random choices, for repeatable files (the default is a random seed)
+
+    Returns
+    ----------
+    (int, int)
+        The number of rows in the GPS and OBD files
+    """
+    rng = np.random.default_rng(seed)
+    if route is None:
+        route = generate_route(duration * max(SPEED_TARGETS) * KMH_TO_MS, seed=rng.integers(1 << 32))
+    speeds = generate_speed_profile(duration, seed=rng.integers(1 << 32))
+    distances = np.concatenate(([0], np.cumsum((speeds[1:] + speeds[:-1]) / 2 * KMH_TO_MS)))
+    gps_seconds = np.arange(0, duration + 1e-9, 1 / gps_rate)
+    points = __route_positions(route, distances, gps_seconds)
+    noise = rng.normal(0, gps_noise, (len(points), 2)) / EARTH_RADIUS
+    points[:, 0] += np.degrees(noise[:, 0])
+    points[:, 1] += np.degrees(noise[:, 1] / np.cos(np.radians(points[:, 0])))
+    gps_times = start_time + np.round(gps_seconds * 1000).astype(np.int64)
+    with open(gps_output_path, 'w', newline='') as file:
+        csv.writer(file).writerows(zip(gps_times.tolist(), points[:, 0].tolist(), points[:, 1].tolist()))
+
+    # The calls are spread unevenly, like the replies of a real OBD adapter, starting a little before the first fix
+    obd_seconds = np.cumsum(rng.uniform(0.5, 1.5, int(duration * obd_rate) + 1) / obd_rate) - 1 / obd_rate
+    obd_seconds = obd_seconds[obd_seconds <= duration]
+    commands = MODE_COMMANDS[obd_mode]
+    obd_speeds = np.interp(obd_seconds, np.arange(duration + 1), speeds)
+    accelerations = np.interp(obd_seconds, np.arange(duration), np.diff(speeds) * KMH_TO_MS) if duration else \
+        np.zeros(len(obd_seconds))
+    values = __command_values(obd_speeds, accelerations, rng)
+    obd_times = start_time + np.round(obd_seconds * 1000).astype(np.int64)
+    with open(obd_output_path, 'w', newline='') as file:
+        csv.writer(file).writerows((time, commands[i % len(commands)].value, values[commands[i % len(commands)]][i])
+                                   for i, time in enumerate(obd_times.tolist()))
+    return len(gps_times), len(obd_times)
+
+
+def generate_drive_dir(output_dir_path, drive_count, obd_mode, duration, gps_rate=DEFAULT_GPS_RATE,
+                       obd_rate=DEFAULT_OBD_RATE, gps_noise=DEFAULT_GPS_NOISE, seed=None):
+    """Writes the GPS and OBD files of several drives along the same route, named the way
+    `csv_util.combine_dir_drive_files_and_save()` pairs them
+
+    Parameters
+    ----------
+    output_dir_path : str
+        The directory of the files, created if it does not exist
+    drive_count : int
+        The number of drives
+    obd_mode : OBDModes enum value
+        The OBD mode of the drives
+    duration : int
+        The length of every drive in seconds
+    gps_rate, obd_rate, gps_noise
+        As `generate_drive_files()` takes them
+    seed : int, optional
+        The seed of the random choices, for repeatable files (the default is a random seed)
+
+    Returns
+    ----------
+    List[(str, str)]
+        The GPS and OBD paths of every drive
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(output_dir_path, exist_ok=True)
+    route = generate_route(duration * max(SPEED_TARGETS) * KMH_TO_MS, seed=rng.integers(1 << 32))
+    paths = []
+    for i in range(drive_count):
+        gps_path = os.path.join(output_dir_path, 'GPS drive ' + str(i).zfill(4) + '.csv')
+        obd_path = os.path.join(output_dir_path, 'OBD drive ' + str(i).zfill(4) + '.csv')
+        generate_drive_files(gps_path, obd_path, obd_mode, duration, route=route, gps_rate=gps_rate,
+                             obd_rate=obd_rate, gps_noise=gps_noise, start_time=DEFAULT_START_TIME + i * 86400000,
+                             seed=rng.integers(1 << 32))
+        paths.append((gps_path, obd_path))
+    return paths
+
+
+def __route_positions(route, distances, seconds):
+    """The latlongs of the car at some seconds into the drive, past the end of the route it keeps going in the direction
+    of the last route step"""
+    distance = np.interp(seconds, np.arange(len(distances)), distances)
+    route_distances = np.arange(len(route)) * ROUTE_STEP
+    last_step = route[-1] - route[-2] if len(route) > 1 else np.zeros(2)
+    beyond = np.maximum(distance - route_distances[-1], 0)[:, None] / ROUTE_STEP
+    return np.column_stack((np.interp(distance, route_distances, route[:, 0]),
+                            np.interp(distance, route_distances, route[:, 1]))) + beyond * last_step
+
+
+def __command_values(speeds, accelerations, rng):
+    """The value of every command at every call, from the speed and acceleration of the car at the time of the call"""
+    throttle = np.clip(accelerations / ACCELERATION, 0, 1)
+    rpms = np.clip(800 + speeds * 25 + throttle * 800 + rng.normal(0, 50, len(speeds)), 700, 6000)
+    pressures = np.clip(30 + speeds * 0.3 + throttle * 50 + rng.normal(0, 3, len(speeds)), 20, 101)
+    return {
+        CommandNames.SPEED: np.round(speeds).astype(np.int64).tolist(),
+        CommandNames.ENGINE_RPM: np.round(rpms).astype(np.int64).tolist(),
+        CommandNames.INTAKE_MANIFOLD_PRESSURE: np.round(pressures).astype(np.int64).tolist(),
+        CommandNames.AIR_INTAKE_TEMP: (25 + rng.normal(0, 2, len(speeds))).tolist(),
+        CommandNames.MAF: (1.5 + rpms / 1000 * pressures / 100 * 12).tolist(),
+        CommandNames.FUEL_CONSUMPTION_RATE: np.maximum(0.6 + speeds * 0.07 + throttle * 8, 0.3).tolist()
+    }
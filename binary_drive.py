@@ -0,0 +1,117 @@
+import json
+import struct
+
+import numpy as np
+
+BINARY_DRIVE_MAGIC = b'ECODRIVE'
+BINARY_DRIVE_VERSION = 1
+BINARY_DRIVE_EXTENSION = '.drive'
+HEADER_LENGTH = struct.Struct('<I')  # The length of the JSON metadata after the magic
+DATA_ALIGNMENT = 64  # The metadata is padded so the columns after it start aligned
+
+
+class BinaryDrive:
+    """A drive file in the binary columnar format, mapped into memory
+
+    The file is the magic `BINARY_DRIVE_MAGIC`, the length of a JSON metadata object, the metadata itself, with the
+    format version, the OBD mode, the row count and the name and type of every column, padded to `DATA_ALIGNMENT`
+    bytes, and then every column as a little endian array, one after the other.
+
+    Parameters
+    ----------
+    input_path : str
+        The path of the binary drive file
+
+    Attributes
+    ----------
+    obd_mode : OBDModes enum value
+        The OBD mode of the drive, None for a GPS file
+    names : List[str]
+        The column names, the header of the CSV file the drive was converted from
+    columns : Dict[str, numpy.ndarray]
+        Every column by its name, read only views of the mapped file
+    """
+
+    def __init__(self, input_path):
+        with open(input_path, 'rb') as file:
+            if file.read(len(BINARY_DRIVE_MAGIC)) != BINARY_DRIVE_MAGIC:
+                raise ValueError(input_path + ' is not a binary drive file')
+            metadata_length = HEADER_LENGTH.unpack(file.read(HEADER_LENGTH.size))[0]
+            metadata = json.loads(file.read(metadata_length).decode('utf-8'))
+            # The columns start at the first aligned offset after the metadata
+            data_offset = -(-file.tell() // DATA_ALIGNMENT) * DATA_ALIGNMENT
+        if metadata['version'] != BINARY_DRIVE_VERSION:
+            raise ValueError(input_path + ' has binary drive version ' + str(metadata['version']) +
+                             ', only version ' + str(BINARY_DRIVE_VERSION) + ' is supported')
+        self.obd_mode = metadata['obd_mode']
+        self.names = [column['name'] for column in metadata['columns']]
+        row_count = metadata['row_count']
+        mapped = np.memmap(input_path, dtype=np.uint8, mode='r')
+        offset = data_offset
+        self.columns = {}
+        for column in metadata['columns']:
+            dtype = np.dtype(column['dtype'])
+            if offset + row_count * dtype.itemsize > len(mapped):
+                raise ValueError(input_path + ' is truncated')
+            self.columns[column['name']] = np.frombuffer(mapped, dtype=dtype, count=row_count, offset=offset)
+            offset += row_count * dtype.itemsize
+
+    def __len__(self):
+        return len(self.columns[self.names[0]]) if self.names else 0
+
+    def column(self, index):
+        """A column by its position, negative positions count from the last column"""
+        return self.columns[self.names[index]]
+
+    def points(self):
+        """The latitude and longitude columns as an array of shape (n, 2), a copy"""
+        return np.column_stack((self.column(1), self.column(2))).astype(np.float64)
+
+    def rows(self):
+        """The rows as lists of floats, what `csv_util.load_drive_file()` returns for the CSV file"""
+        return np.column_stack([self.columns[name].astype(np.float64) for name in self.names]).tolist() if \
+            len(self) else []
+
+
+def write_binary_drive_file(output_path, names, columns, obd_mode=None):
+    """Writes columns to a binary drive file, which `BinaryDrive` maps back without parsing
+
+    Parameters
+    ----------
+    output_path : str
+        The path of the binary drive file
+    names : List[str]
+        The column names
+    columns : List[numpy.ndarray]
+        The columns, of equal lengths, in the order of `names`, each is stored in its own type
+    obd_mode : OBDModes enum value, optional
+        The OBD mode of the drive (the default is None, for a GPS file)
+    """
+    columns = [np.ascontiguousarray(column, dtype=np.asarray(column).dtype.newbyteorder('<')) for column in columns]
+    if len({len(column) for column in columns}) > 1:
+        raise ValueError('The columns have different lengths')
+    metadata = json.dumps({'version': BINARY_DRIVE_VERSION, 'obd_mode': obd_mode,
+                           'row_count': len(columns[0]) if columns else 0,
+                           'columns': [{'name': name, 'dtype': column.dtype.str} for name, column in
+                                       zip(names, columns)]}).encode('utf-8')
+    with open(output_path, 'wb') as file:
+        file.write(BINARY_DRIVE_MAGIC + HEADER_LENGTH.pack(len(metadata)) + metadata)
+        file.write(b'\0' * (__data_offset(len(metadata)) - file.tell()))
+        for column in columns:
+            file.write(column.tobytes())
+
+
+def is_binary_drive_file(path):
+    """Whether a file is a binary drive file, by its magic"""
+    with open(path, 'rb') as file:
+        return file.read(len(BINARY_DRIVE_MAGIC)) == BINARY_DRIVE_MAGIC
+
+
+def load_binary_drive_file(input_path):
+    """Maps a binary drive file into memory, see `BinaryDrive`"""
+    return BinaryDrive(input_path)
+
+
+def __data_offset(metadata_length):
+    header_length = len(BINARY_DRIVE_MAGIC) + HEADER_LENGTH.size + metadata_length
+    return -(-header_length // DATA_ALIGNMENT) * DATA_ALIGNMENT
@@ -1,7 +1,16 @@
 import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from csv import reader
 from csv import writer
+from itertools import islice
 
+import numpy as np
+
+from binary_drive import BINARY_DRIVE_EXTENSION
+from binary_drive import is_binary_drive_file
+from binary_drive import load_binary_drive_file
+from binary_drive import write_binary_drive_file
 from util import CommandNames
 from util import DEFAULT_ENGINE_DISPLACEMENT
 from util import DEFAULT_VOLUMETRIC_EFFICIENCY
@@ -12,6 +21,33 @@ from util import calculate_fuel_consumption
 from util import calculate_maf
 
 
+# The commands each OBD mode needs in order to generate a drive file
+__OBD_MODE_COMMAND_NAMES = {
+    OBDModes.RPM.value: (CommandNames.SPEED, CommandNames.ENGINE_RPM, CommandNames.INTAKE_MANIFOLD_PRESSURE,
+                         CommandNames.AIR_INTAKE_TEMP),
+    OBDModes.MAF.value: (CommandNames.SPEED, CommandNames.MAF),
+    OBDModes.FUEL.value: (CommandNames.SPEED, CommandNames.FUEL_CONSUMPTION_RATE)
+}
+
+BULK_CHUNK_ROWS = 65536  # OBD rows parsed by numpy at a time
+BULK_FIELD_LENGTH = 32  # The longest OBD command name and value parsed by numpy, longer ones are parsed row by row
+
+# The drive file columns which are written as integers, the rest are floats
+__INTEGER_DRIVE_COLUMNS = {'Time', 'Speed', 'Engine RPM', 'Intake Manifold Pressure'}
+# The columns of a gps file, which has no header
+__GPS_COLUMNS = ['Time', 'Latitude', 'Longitude']
+
+# The command a csv command name stands for, the array type code of its values and their conversion function
+__OBD_COLUMN_TYPES = {
+    CommandNames.SPEED.value: (CommandNames.SPEED, 'q', int),
+    CommandNames.ENGINE_RPM.value: (CommandNames.ENGINE_RPM, 'q', int),
+    CommandNames.INTAKE_MANIFOLD_PRESSURE.value: (CommandNames.INTAKE_MANIFOLD_PRESSURE, 'q', int),
+    CommandNames.AIR_INTAKE_TEMP.value: (CommandNames.AIR_INTAKE_TEMP, 'd', float),
+    CommandNames.MAF.value: (CommandNames.MAF, 'd', float),
+    CommandNames.FUEL_CONSUMPTION_RATE.value: (CommandNames.FUEL_CONSUMPTION_RATE, 'd', float)
+}
+
+
 def load_csv_file(input_path, delimiter=','):
     """ Loads a csv file into a matrix
 
@@ -29,6 +65,7 @@ def load_csv_file(input_path, delimiter=','):
         contains all the CSV data, separated into lines and by the delimiter
 
     """
+    __reject_binary_file(input_path)
     with open(input_path, "r") as f:
         matrix = []
         csv_reader = reader(f, delimiter=delimiter)
@@ -52,6 +89,10 @@ def load_gps_file(input_path, delimiter=','):
     List[List[Union[int, float]]]
         A matrix which contains all the CSV data, separated into lines and by the delimiter and converted to the correct types
     """
+    if is_binary_drive_file(input_path):
+        drive = load_binary_drive_file(input_path)
+        return [[int(time), lat, lon] for time, lat, lon in
+                zip(drive.column(0).tolist(), drive.column(1).tolist(), drive.column(2).tolist())]
     return_matrix = []
     matrix = load_csv_file(input_path, delimiter)
     for row in matrix:
@@ -93,7 +134,221 @@ def load_obd_file(input_path, delimiter=','):
     return return_matrix
 
 
+def load_obd_columns(input_path, delimiter=','):
+    """Loads an obd csv file into a typed time and value column pair per command
+
+    Parameters
+    ----------
+    input_path : str
+            The path of the CSV file in string format
+
+    delimiter : str , optional
+        The separating string in the CSV file (the default is a comma)
+
+    Returns
+    -------
+    Dict[CommandNames, (numpy.ndarray, numpy.ndarray)]
+        Maps every command found in the file to its call times (int64) and values (int64 or float64, depending on the
+        command), sorted by time. Calls of commands which are not in `CommandNames` are dropped
+
+    Notes
+    --------
+    The sort is stable and only the first call of every repeated time is kept, so a closest call lookup picks the same
+    call a linear scan over the file would have picked
+
+    The file is parsed by numpy `BULK_CHUNK_ROWS` rows at a time. A chunk with non numeric values, like trouble codes,
+    is parsed again with the values as strings, and a chunk with quoted fields or which numpy can't parse at all is
+    parsed row by row
+
+    See Also
+    -------
+    `load_obd_file()` for the row based version
+    """
+    __reject_binary_file(input_path)
+    raw_columns = {}
+    with open(input_path, "r") as f:
+        while True:
+            lines = list(islice(f, BULK_CHUNK_ROWS))
+            if not lines:
+                break
+            if any('"' in line for line in lines):
+                # numpy keeps the quotes of quoted fields, so a quoted command would match no command
+                __add_obd_rows(reader(lines, delimiter=delimiter), raw_columns)
+                continue
+            try:
+                __add_obd_chunk_bulk(lines, delimiter, raw_columns, True)
+            except ValueError:
+                try:
+                    __add_obd_chunk_bulk(lines, delimiter, raw_columns, False)
+                except ValueError:
+                    # Rows which numpy can't parse, like a different number of fields, go through the csv module one by
+                    # one
+                    __add_obd_rows(reader(lines, delimiter=delimiter), raw_columns)
+    obd_columns = {}
+    for command_value, (times, values) in raw_columns.items():
+        obd_columns[__OBD_COLUMN_TYPES[command_value][0]] = __to_obd_column(
+            np.concatenate(times), np.concatenate(values))
+    return obd_columns
+
+
+def __add_obd_chunk_bulk(lines, delimiter, raw_columns, numeric_values):
+    # Values which aren't all numbers, like trouble codes, are kept as strings, and only those of loaded commands are
+    # converted, which is slower
+    chunk = np.loadtxt(lines, delimiter=delimiter, ndmin=1, dtype=[
+        ('time', np.int64), ('command', 'U' + str(BULK_FIELD_LENGTH)),
+        ('value', np.float64 if numeric_values else 'U' + str(BULK_FIELD_LENGTH))])
+    found_columns = []
+    for command_value, column_type in __OBD_COLUMN_TYPES.items():
+        rows = chunk['command'] == command_value
+        if not rows.any():
+            continue
+        values = chunk['value'][rows]
+        if not numeric_values and np.char.str_len(values).max() >= BULK_FIELD_LENGTH:
+            raise ValueError('A value may have been cut')
+        if numeric_values and column_type[1] == 'q' and not np.array_equal(values, np.trunc(values)):
+            raise ValueError('An integer command has a fractional value')
+        found_columns.append((command_value, chunk['time'][rows],
+                              values.astype(np.int64 if column_type[1] == 'q' else np.float64)))
+    # The chunk is added only once all of it parsed, so a fallback never adds a row twice
+    for command_value, times, values in found_columns:
+        raw_columns.setdefault(command_value, ([], []))
+        raw_columns[command_value][0].append(times)
+        raw_columns[command_value][1].append(values)
+
+
+def __add_obd_rows(csv_reader, raw_columns):
+    row_columns = {}
+    for row in csv_reader:
+        column_type = __OBD_COLUMN_TYPES.get(row[1])
+        if column_type is None:
+            continue
+        if row[1] not in row_columns:
+            row_columns[row[1]] = (array('q'), array(column_type[1]))
+        times, values = row_columns[row[1]]
+        times.append(int(row[0]))
+        values.append(column_type[2](row[2]))
+    for command_value, (times, values) in row_columns.items():
+        raw_columns.setdefault(command_value, ([], []))
+        raw_columns[command_value][0].append(np.frombuffer(times, dtype=np.int64))
+        raw_columns[command_value][1].append(np.frombuffer(values, dtype=np.int64 if values.typecode == 'q'
+                                                           else np.float64))
+
+
+def __reject_binary_file(input_path):
+    if is_binary_drive_file(input_path):
+        raise ValueError(input_path + ' is a binary drive file, load it with load_drive_file(), load_gps_file() or '
+                                      'binary_drive.load_binary_drive_file()')
+
+
+def __to_obd_column(times, values):
+    """Converts the raw calls of a single command into a sorted column pair, keeping the first call of every time
+
+    Parameters
+    ----------
+    times : Union[array.array, numpy.ndarray]
+        The call times, with type code 'q' if given as an array
+    values : Union[array.array, numpy.ndarray]
+        The call values, with type code 'q' or 'd' if given as an array
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray)
+        The sorted times and their values
+    """
+    if isinstance(times, array):
+        times = np.frombuffer(times, dtype=np.int64)
+        values = np.frombuffer(values, dtype=np.int64 if values.typecode == 'q' else np.float64)
+    order = np.argsort(times, kind='stable')
+    times = times[order]
+    values = values[order]
+    first_of_time = np.ones(len(times), dtype=bool)
+    first_of_time[1:] = times[1:] != times[:-1]
+    return times[first_of_time], values[first_of_time]
+
+
+def load_drive_columns(input_path, delimiter=',', has_header=True, obd_mode=None):
+    """ Loads a drive file, CSV or binary, into a typed column per header field, parsing the CSV in bulk
+
+    Parameters
+    ----------
+    input_path : str
+        The path of the drive file
+    delimiter : str , optional
+        The separating string in the CSV file (the default is a comma)
+    has_header : bool , optional
+        Does the CSV file have a header (the default is True)
+    obd_mode : OBDModes enum value, optional
+        The OBD mode whose `util.Headers` name the columns of a CSV file without a header (the default is numbering the
+        columns from '0')
+
+    Returns
+    -------
+    Dict[str, numpy.ndarray]
+        Every column by its name, in file order. Time, Speed, Engine RPM and Intake Manifold Pressure are int64 and the
+        rest are float64, a CSV file whose values don't fit those types is loaded with `load_drive_file()` into float64
+        columns instead
+
+    See Also
+    -------
+    `load_drive_file()` for the row based version
+    """
+    if is_binary_drive_file(input_path):
+        return dict(load_binary_drive_file(input_path).columns)
+    with open(input_path, 'r') as file:
+        header = next(reader([file.readline()], delimiter=delimiter), []) if has_header else None
+        first_row = next(reader([file.readline()], delimiter=delimiter), [])
+    if header is None:
+        header = Headers[obd_mode] if obd_mode is not None else [str(i) for i in range(len(first_row))]
+    if not first_row:
+        return {name: np.zeros(0, dtype=np.int64 if name in __INTEGER_DRIVE_COLUMNS else np.float64)
+                for name in header}
+    try:
+        data = np.loadtxt(input_path, delimiter=delimiter, skiprows=1 if has_header else 0, ndmin=1,
+                          dtype=[(str(i), np.int64 if name in __INTEGER_DRIVE_COLUMNS else np.float64)
+                                 for i, name in enumerate(header)])
+        return {name: data[str(i)] for i, name in enumerate(header)}
+    except ValueError:
+        matrix = np.array(load_drive_file(input_path, delimiter=delimiter, has_header=has_header),
+                          dtype=np.float64).reshape(-1, len(header))
+        return {name: matrix[:, i] for i, name in enumerate(header)}
+
+
+def load_gps_columns(input_path, delimiter=','):
+    """ Loads a gps csv file, or a binary one, into typed columns, parsing the CSV in bulk
+
+    Parameters
+    ----------
+    input_path : str
+        The path of the gps file
+    delimiter : str , optional
+        The separating string in the CSV file (the default is a comma)
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        The times (int64), latitudes and longitudes
+
+    See Also
+    -------
+    `load_gps_file()` for the row based version
+    """
+    if is_binary_drive_file(input_path):
+        drive = load_binary_drive_file(input_path)
+        return drive.column(0), drive.column(1), drive.column(2)
+    try:
+        data = np.loadtxt(input_path, delimiter=delimiter, usecols=(0, 1, 2), ndmin=1,
+                          dtype=[('time', np.int64), ('lat', np.float64), ('lon', np.float64)])
+        return data['time'], data['lat'], data['lon']
+    except ValueError:
+        matrix = load_gps_file(input_path, delimiter=delimiter)
+        return np.array([row[0] for row in matrix], dtype=np.int64), \
+            np.array([row[1] for row in matrix], dtype=np.float64), \
+            np.array([row[2] for row in matrix], dtype=np.float64)
+
+
 def load_drive_file(input_path, delimiter=',', has_header=True):
+    if is_binary_drive_file(input_path):
+        return load_binary_drive_file(input_path).rows()
     return_matrix = []
     with open(input_path, 'r') as file:
         csv_reader = reader(file, delimiter=delimiter)
@@ -106,7 +361,7 @@ def load_drive_file(input_path, delimiter=',', has_header=True):
     return return_matrix
 
 
-def load_dir_gps_points(input_dir_path, has_header=True):
+def load_dir_gps_points(input_dir_path, has_header=True, drive_cache=None):
     """ Loads the gps points from all the files in a directory. All the files have to be either gps or drive files
 
     Parameters
@@ -116,6 +371,8 @@ def load_dir_gps_points(input_dir_path, has_header=True):
 
     has_header : bool , optional
         Does the files in the directory have headers (the default is True)
+    drive_cache : drive_cache.DriveCache , optional
+        The cache the points of unchanged files are loaded from instead of parsed (the default is not caching)
 
     Returns
     -------
@@ -129,10 +386,141 @@ def load_dir_gps_points(input_dir_path, has_header=True):
     """
     final_list = []
     for filename in os.listdir(input_dir_path):
+        if drive_cache is not None:
+            final_list.extend(zip(*(column.tolist() for column in
+                                    drive_cache.load_gps_points(os.path.join(input_dir_path, filename), has_header))))
+            continue
         final_list.extend(load_file_gps_points(os.path.join(input_dir_path, filename), has_header=has_header))
     return final_list
 
 
+def iterate_dir_gps_points(input_dir_path, has_header=True, filenames=None, drive_cache=None):
+    """ Yields the gps points of the files in a directory one at a time, without loading the files into memory. All the
+    files have to be either gps or drive files
+
+    Parameters
+    ----------
+    input_dir_path : str
+            The path of the CSV directory in string format
+    has_header : bool , optional
+        Does the files in the directory have headers (the default is True)
+    filenames : List[str] , optional
+        The files to read and their order (the default is all the files in the directory, in `os.listdir()` order)
+    drive_cache : drive_cache.DriveCache , optional
+        The cache the points of unchanged files are loaded from instead of parsed, a file at a time (the default is
+        not caching)
+
+    Returns
+    -------
+    Iterator[(float,float)]
+        The GPS points as tuples
+
+    See Also
+    -------
+    `load_dir_gps_points()` which loads all the points into a list
+    """
+    for filename in os.listdir(input_dir_path) if filenames is None else filenames:
+        if drive_cache is not None:
+            lats, lons = drive_cache.load_gps_points(os.path.join(input_dir_path, filename), has_header)
+            yield from zip(lats.tolist(), lons.tolist())
+            continue
+        if is_binary_drive_file(os.path.join(input_dir_path, filename)):
+            drive = load_binary_drive_file(os.path.join(input_dir_path, filename))
+            yield from zip(drive.column(1).tolist(), drive.column(2).tolist())
+            continue
+        with open(os.path.join(input_dir_path, filename), 'r') as file:
+            csv_reader = reader(file)
+            if has_header:
+                next(csv_reader, None)
+            for row in csv_reader:
+                yield float(row[1]), float(row[2])
+
+
+def convert_drive_file_to_binary(input_path, output_path, obd_mode=None, delimiter=',', has_header=True):
+    """ Converts a drive or gps CSV file to the binary columnar format of `binary_drive`, which every drive and gps
+    loader in this module reads as well. OBD files can't be converted, the OBD loaders and `load_csv_file()` reject
+    binary files
+
+    Parameters
+    ----------
+    input_path : str
+        The path of the CSV file
+    output_path : str
+        The path for the binary file
+    obd_mode : OBDModes enum value, optional
+        Which OBD mode is the vehicle in (the default is the mode whose `util.Headers` are the header of the file, or
+        none for a gps file)
+    delimiter : str, optional
+        The separating string in the CSV file (the default is a comma)
+    has_header : bool, optional
+        Does the file have a header, a file without one takes the column names of `obd_mode`, or the time, latitude
+        and longitude of a gps file if there is no `obd_mode` (the default is True)
+
+    Returns
+    -------
+    int
+        The number of rows converted
+    """
+    with open(input_path, 'r') as file:
+        csv_reader = reader(file, delimiter=delimiter)
+        if has_header:
+            names = next(csv_reader, [])
+        else:
+            names = Headers[obd_mode] if obd_mode is not None else __GPS_COLUMNS
+        if obd_mode is None:
+            obd_mode = next((mode for mode, headers in Headers.items() if headers == names), None)
+        columns = [array('q' if name in __INTEGER_DRIVE_COLUMNS else 'd') for name in names]
+        for row in csv_reader:
+            for i in range(len(columns)):
+                if columns[i].typecode == 'q':
+                    try:
+                        columns[i].append(int(row[i]))
+                        continue
+                    except ValueError:
+                        # A value which isn't an integer turns the whole column into floats
+                        columns[i] = array('d', columns[i])
+                columns[i].append(float(row[i]))
+    write_binary_drive_file(output_path, names, [np.frombuffer(column, dtype=np.int64 if column.typecode == 'q'
+                                                               else np.float64) for column in columns], obd_mode)
+    return len(columns[0]) if columns else 0
+
+
+def convert_dir_drive_files_to_binary(input_dir_path, output_dir_path, obd_mode=None, delimiter=',', has_header=True,
+                                      create=True, print_logs=True):
+    """ Converts every drive or gps CSV file in a directory to the binary columnar format, the output file names are the
+    input ones with the `binary_drive.BINARY_DRIVE_EXTENSION` extension
+
+    Parameters
+    ----------
+    input_dir_path : str
+        The path of the directory which holds the CSV files
+    output_dir_path : str
+        The path for the output directory
+    obd_mode : OBDModes enum value, optional
+        Which OBD mode is the vehicle in (the default is detecting it from the header of every file)
+    delimiter : str, optional
+        The separating string in the CSV files (the default is a comma)
+    has_header : bool, optional
+        Do the files have headers (the default is True)
+    create : bool
+        Create the output directory if it does not exist (the default is True)
+    print_logs : bool
+        Print logs while the function is running (the default is True)
+
+    See Also
+    -------
+    `convert_drive_file_to_binary()` for the single file version
+    """
+    if not os.path.exists(output_dir_path) and create:
+        os.makedirs(output_dir_path)
+    for filename in os.listdir(input_dir_path):
+        output_path = os.path.join(output_dir_path, os.path.splitext(filename)[0] + BINARY_DRIVE_EXTENSION)
+        row_count = convert_drive_file_to_binary(os.path.join(input_dir_path, filename), output_path,
+                                                 obd_mode=obd_mode, delimiter=delimiter, has_header=has_header)
+        if print_logs:
+            print('converted ' + filename + ', ' + str(row_count) + ' rows')
+
+
 def load_driving_model_file(input_path):
     mat = []
     with open(input_path, "r", encoding='utf') as f:
@@ -142,6 +530,33 @@ def load_driving_model_file(input_path):
     return mat
 
 
+def load_driving_model_columns(input_path):
+    """ Loads a driving model file into typed columns, parsing it in bulk
+
+    Parameters
+    ----------
+    input_path : str
+        The path of the driving model file
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        The latitudes, longitudes, speeds (int64) and costs
+
+    See Also
+    -------
+    `load_driving_model_file()` for the row based version
+    """
+    try:
+        data = np.loadtxt(input_path, delimiter=',', ndmin=1, encoding='utf',
+                          dtype=[('lat', np.float64), ('lon', np.float64), ('speed', np.int64), ('cost', np.float64)])
+        return data['lat'], data['lon'], data['speed'], data['cost']
+    except ValueError:
+        matrix = load_driving_model_file(input_path)
+        return tuple(np.array([row[i] for row in matrix], dtype=np.int64 if i == 2 else np.float64)
+                     for i in range(4))
+
+
 def load_file_gps_points(input_path, has_header=True):
     """ Loads the gps points from either a gps or drive file
 
@@ -158,6 +573,9 @@ def load_file_gps_points(input_path, has_header=True):
     List[(float,float)]
         A list of tuples representing the GPS points
     """
+    if is_binary_drive_file(input_path):
+        drive = load_binary_drive_file(input_path)
+        return list(zip(drive.column(1).tolist(), drive.column(2).tolist()))
     with open(input_path, 'r') as file:
         csv_reader = reader(file)
         if has_header:
@@ -190,16 +608,15 @@ def combine_drive_files(gps_input_path, obd_input_path, obd_mode, delimiter=',',
 
     See Also
     -------
-    `load_gps_file()` which loads a GPS file
+    `load_gps_columns()` which loads a GPS file
 
-    `load_obd_file()` which loads an OBD file
+    `load_obd_columns()` which loads an OBD file
     """
-    gps_matrix = load_gps_file(gps_input_path, delimiter=delimiter)
-    obd_matrix = load_obd_file(obd_input_path, delimiter=delimiter)
-    return_matrix = []
-    for row in gps_matrix:
-        return_matrix.append(__generate_full_data_call(row, obd_matrix, obd_mode=obd_mode, fuel_type=fuel_type))
-    return return_matrix
+    gps_times, lats, lons = load_gps_columns(gps_input_path, delimiter=delimiter)
+    obd_columns = load_obd_columns(obd_input_path, delimiter=delimiter)
+    data_columns = __generate_full_data_columns(gps_times, obd_columns, obd_mode=obd_mode, fuel_type=fuel_type)
+    return [[time, lat, lon] + list(obd_values) for time, lat, lon, obd_values in
+            zip(gps_times.tolist(), lats.tolist(), lons.tolist(), zip(*data_columns))]
 
 
 def combine_drive_files_and_save(gps_input_path, obd_input_path, obd_mode, output_path, delimiter=',',
@@ -243,8 +660,120 @@ def combine_drive_files_and_save(gps_input_path, obd_input_path, obd_mode, outpu
     return matrix
 
 
+def stream_combine_drive_files_and_save(gps_input_path, obd_input_path, obd_mode, output_path, delimiter=',',
+                                        fuel_type=FuelTypes.GASOLINE.value, create=True, chunk_size=10000):
+    """ Combines a pair of obd and gps files into a drive file while reading and writing them, with bounded memory
+
+    Parameters
+    ----------
+     gps_input_path : str
+        The path of the GPS CSV file in string format
+    obd_input_path : str
+        The path of the OBD CSV file in string format
+    obd_mode : OBDModes enum value
+        Which OBD is the vehicle in
+    output_path : str
+        The path of the output file in string format
+    delimiter : str, optional
+        The separating string in the CSV file (the default is a comma)
+    fuel_type : FuelTypes enum value
+        The fuel type used by the vehicle (the default is Gasoline)
+    create : bool
+        Create the output file if it does not exist (the default is True)
+    chunk_size : int
+        The number of GPS rows combined and written at a time (the default is 10000)
+
+    Returns
+    -------
+    int
+        The number of rows written to the drive file, not including the header
+
+    Notes
+    --------
+    Both files have to be sorted by time, which is the order they are recorded in. For every chunk of GPS rows the OBD
+    file is read only until every command has a call after the last row of the chunk, and only the last call before
+    it is kept for the next chunk, so the memory depends on `chunk_size` and not on the length of the drive. A command
+    which stops being reported makes the OBD file be read up to its end.
+
+    See Also
+    -------
+    `combine_drive_files_and_save()` for the in memory version, which writes the same file
+    """
+    command_names = __OBD_MODE_COMMAND_NAMES[obd_mode]
+    kept_columns = {}
+    row_count = 0
+    with open(gps_input_path, 'r') as gps_file, open(obd_input_path, 'r') as obd_file, \
+            open(output_path, 'w+' if create else 'w', newline='') as file:
+        gps_reader = reader(gps_file, delimiter=delimiter)
+        obd_calls = __read_obd_calls(reader(obd_file, delimiter=delimiter), command_names)
+        last_call_times = {}
+        csv_writer = writer(file, delimiter=delimiter)
+        csv_writer.writerow(Headers[obd_mode])
+        while True:
+            gps_matrix = [[int(row[0]), float(row[1]), float(row[2])] for row in islice(gps_reader, chunk_size)]
+            if not gps_matrix:
+                break
+            gps_times = np.array([row[0] for row in gps_matrix], dtype=np.int64)
+            last_gps_time = gps_times.max()
+            new_calls = {command_name: (array('q'), array(__OBD_COLUMN_TYPES[command_name.value][1]))
+                         for command_name in command_names}
+            # Move the window end until every command has a call at or after the end of the chunk
+            behind_command_names = {command_name for command_name in command_names
+                                    if last_call_times.get(command_name, last_gps_time - 1) < last_gps_time}
+            while behind_command_names:
+                obd_call = next(obd_calls, None)
+                if obd_call is None:
+                    break
+                new_calls[obd_call[0]][0].append(obd_call[1])
+                new_calls[obd_call[0]][1].append(obd_call[2])
+                last_call_times[obd_call[0]] = obd_call[1]
+                if obd_call[1] >= last_gps_time:
+                    behind_command_names.discard(obd_call[0])
+            obd_columns = {}
+            for command_name in command_names:
+                times, values = new_calls[command_name]
+                times = np.frombuffer(times, dtype=np.int64)
+                values = np.frombuffer(values, dtype=np.int64 if values.typecode == 'q' else np.float64)
+                if command_name in kept_columns:
+                    times = np.concatenate((kept_columns[command_name][0], times))
+                    values = np.concatenate((kept_columns[command_name][1], values))
+                if len(times):
+                    obd_columns[command_name] = __to_obd_column(times, values)
+            data_columns = __generate_full_data_columns(gps_times, obd_columns, obd_mode=obd_mode, fuel_type=fuel_type)
+            csv_writer.writerows(row[:3] + list(obd_values) for row, obd_values in zip(gps_matrix, zip(*data_columns)))
+            row_count += len(gps_matrix)
+            # Move the window start to the last call before the end of the chunk, earlier calls can't be the closest
+            kept_columns = {}
+            for command_name, (times, values) in obd_columns.items():
+                start = max(np.searchsorted(times, last_gps_time, side='left') - 1, 0)
+                kept_columns[command_name] = (times[start:].copy(), values[start:].copy())
+    return row_count
+
+
+def __read_obd_calls(obd_reader, command_names):
+    """Yields the calls of an OBD csv reader which belong to `command_names`
+
+    Parameters
+    ----------
+    obd_reader : csv.reader
+        A reader over an OBD CSV file
+    command_names : Tuple[CommandNames]
+        The commands to yield the calls of
+
+    Returns
+    -------
+    Iterator[(CommandNames, int, Union[int,float])]
+        The command, time and value of every call, in the file order
+    """
+    for row in obd_reader:
+        column_type = __OBD_COLUMN_TYPES.get(row[1])
+        if column_type is not None and column_type[0] in command_names:
+            yield column_type[0], int(row[0]), column_type[2](row[2])
+
+
 def combine_dir_drive_files_and_save(input_dir_path, output_dir_path, obd_mode, delimiter=',',
-                                     fuel_type=FuelTypes.GASOLINE.value, create=True, print_logs=True):
+                                     fuel_type=FuelTypes.GASOLINE.value, create=True, print_logs=True, workers=1,
+                                     streaming=False):
     """ Combines a pairs of obd and gps files in a directory into drive files and saves them
 
         Parameters
@@ -263,52 +792,120 @@ def combine_dir_drive_files_and_save(input_dir_path, output_dir_path, obd_mode,
             Create the output file if it does not exist (the default is True)
         print_logs : bool
             Print logs while the function is running (the default is True)
+        workers : int
+            The number of processes combining pairs at the same time, 1 combines them in the calling process (the
+            default is 1)
+        streaming : bool
+            Combine every pair with `stream_combine_drive_files_and_save()`, for drives too long to fit in memory (the
+            default is False)
 
         Returns
         -------
-        List[List[Union[int,float]]]
-            A drive matrix, containing the combined information from the GPS and OBD files which was converted to the
-            correct types
+        List[(str, Exception)]
+            The output path and the raised exception of every pair which failed to combine, a failed pair does not stop
+            the other pairs from being combined
 
         See Also
         -------
         `combine_drive_files_and_save()` for the single file version
         """
-    gps_files = []
-    obd_files = []
-    output_files = []
-    # Load the file paths into lists and generate the output_files list
-    for filename in os.listdir(input_dir_path):
-        if filename.endswith('.csv'):
-            if 'GPS' in filename:
-                gps_files.append(os.path.join(input_dir_path, filename))
-                output_files.append(os.path.join(output_dir_path, filename.replace('GPS ', '')))
-            elif 'OBD' in filename:
-                obd_files.append(os.path.join(input_dir_path, filename))
-    # Sort them so now all three would be aligned with one another
-    sorted(gps_files)
-    sorted(obd_files)
-    sorted(output_files)
+    drive_pairs = __pair_drive_files(input_dir_path, output_dir_path, print_logs=print_logs)
     if not os.path.exists(output_dir_path) and create:
         os.makedirs(output_dir_path)
-    for i in range(len(gps_files)):
-        if print_logs:
-            print('started Working on ' + str(output_files[i]) + ',' + str(len(gps_files) - i) + ' are left')
-        combine_drive_files_and_save(gps_files[i], obd_files[i], obd_mode, output_files[i], delimiter=delimiter,
-                                     fuel_type=fuel_type)
+    failed_pairs = []
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(__combine_drive_pair, drive_pair, obd_mode, delimiter, fuel_type, streaming)
+                       for drive_pair in drive_pairs]
+            # Waiting on the futures in submission order keeps the logs in the same order as the serial run
+            for i in range(len(futures)):
+                try:
+                    futures[i].result()
+                except Exception as e:
+                    failed_pairs.append((drive_pairs[i][2], e))
+                    if print_logs:
+                        print('failed Working on ' + str(drive_pairs[i][2]) + ': ' + repr(e))
+                    continue
+                if print_logs:
+                    print('finished Working on ' + str(drive_pairs[i][2]) + ',' + str(len(drive_pairs) - i - 1) +
+                          ' are left')
+    else:
+        for i in range(len(drive_pairs)):
+            if print_logs:
+                print('started Working on ' + str(drive_pairs[i][2]) + ',' + str(len(drive_pairs) - i) + ' are left')
+            try:
+                __combine_drive_pair(drive_pairs[i], obd_mode, delimiter, fuel_type, streaming)
+            except Exception as e:
+                failed_pairs.append((drive_pairs[i][2], e))
+                if print_logs:
+                    print('failed Working on ' + str(drive_pairs[i][2]) + ': ' + repr(e))
+    return failed_pairs
 
 
-def __generate_full_data_call(gps_call, obd_matrix, obd_mode=OBDModes.MAF.value, fuel_type=FuelTypes.GASOLINE.value,
-                              volumetric_efficiency=DEFAULT_VOLUMETRIC_EFFICIENCY,
-                              engine_displacement=DEFAULT_ENGINE_DISPLACEMENT):
-    """Generates a full data row for the drive matrix depending on the `obd_mode`
+def __pair_drive_files(input_dir_path, output_dir_path, print_logs=True):
+    """Pairs the GPS and OBD files in a directory by their shared drive key
 
     Parameters
     ----------
-    gps_call : List(Union[int,float])
-        A row from a GPS matrix
-    obd_matrix : List(List(Union[int,str,float]))
-        The OBD matrix
+    input_dir_path : str
+        The path of the directory which holds the GPS and OBD CSV files
+    output_dir_path : str
+        The path for the output directory
+    print_logs : bool
+        Print the files which have no pair (the default is True)
+
+    Returns
+    -------
+    List[(str, str, str)]
+        The GPS path, OBD path and output path of every pair, sorted by the drive key
+
+    Notes
+    --------
+    The drive key of a file is its name without the first 'GPS' or 'OBD', so 'GPS 2020-01-01.csv' and
+    'OBD 2020-01-01.csv' share the key '2020-01-01.csv'
+    """
+    gps_files = {}
+    obd_files = {}
+    for filename in os.listdir(input_dir_path):
+        if filename.endswith('.csv'):
+            if 'GPS' in filename:
+                gps_files[filename.replace('GPS', '', 1).strip()] = filename
+            elif 'OBD' in filename:
+                obd_files[filename.replace('OBD', '', 1).strip()] = filename
+    drive_pairs = []
+    for drive_key in sorted(gps_files.keys() | obd_files.keys()):
+        if drive_key not in gps_files or drive_key not in obd_files:
+            if print_logs:
+                print('skipping ' + str(gps_files.get(drive_key, obd_files.get(drive_key))) + ', it has no pair')
+            continue
+        drive_pairs.append((os.path.join(input_dir_path, gps_files[drive_key]),
+                            os.path.join(input_dir_path, obd_files[drive_key]),
+                            os.path.join(output_dir_path, gps_files[drive_key].replace('GPS ', ''))))
+    return drive_pairs
+
+
+def __combine_drive_pair(drive_pair, obd_mode, delimiter, fuel_type, streaming):
+    # Module level so it can be sent to a process pool, the matrix is not returned to avoid sending it back
+    if streaming:
+        stream_combine_drive_files_and_save(drive_pair[0], drive_pair[1], obd_mode, drive_pair[2], delimiter=delimiter,
+                                            fuel_type=fuel_type)
+        return
+    combine_drive_files_and_save(drive_pair[0], drive_pair[1], obd_mode, drive_pair[2], delimiter=delimiter,
+                                 fuel_type=fuel_type)
+
+
+def __generate_full_data_columns(gps_times, obd_columns, obd_mode=OBDModes.MAF.value,
+                                 fuel_type=FuelTypes.GASOLINE.value,
+                                 volumetric_efficiency=DEFAULT_VOLUMETRIC_EFFICIENCY,
+                                 engine_displacement=DEFAULT_ENGINE_DISPLACEMENT):
+    """Generates the OBD data columns of the drive matrix depending on the `obd_mode`
+
+    Parameters
+    ----------
+    gps_times : numpy.ndarray
+        The times of the GPS calls
+    obd_columns : Dict[CommandNames, (numpy.ndarray, numpy.ndarray)]
+        The OBD columns, as loaded by `load_obd_columns()`
     obd_mode : OBDModes enum value
         Which OBD mode is the vehicle in (The default is MAF)
     fuel_type : FuelTypes enum value
@@ -321,28 +918,26 @@ def __generate_full_data_call(gps_call, obd_matrix, obd_mode=OBDModes.MAF.value,
 
     Returns
     ----------
-    List(List(Union[int,str,float]))
-        A full data call, compromised of time, latlong, speed, fuel flow. Depending on `obd_mode` it might also include
-        more information
+    List(List(Union[int,float]))
+        The columns following the time and latlong in the drive matrix, compromised of speed and fuel flow. Depending
+        on `obd_mode` it might also include more information
 
     See Also
     --------
-    `__generate_full_rpm_data_call()` for the RPM data call creation
+    `__generate_full_rpm_data_columns()` for the RPM data columns creation
 
-    `__generate_full_maf_data_call()` for the MAF data call creation
+    `__generate_full_maf_data_columns()` for the MAF data columns creation
 
-    `__generate_full_fuel_data_call()` for the FUEL data call creation
+    `__generate_full_fuel_data_columns()` for the FUEL data columns creation
     """
-    data_call = [gps_call[0], gps_call[1], gps_call[2]]
     if obd_mode == OBDModes.RPM.value:
-        data_call.extend(__generate_full_rpm_data_call(gps_call, obd_matrix, fuel_type=fuel_type,
-                                                       volumetric_efficiency=volumetric_efficiency,
-                                                       engine_displacement=engine_displacement))
+        return __generate_full_rpm_data_columns(gps_times, obd_columns, fuel_type=fuel_type,
+                                                volumetric_efficiency=volumetric_efficiency,
+                                                engine_displacement=engine_displacement)
     elif obd_mode == OBDModes.MAF.value:
-        data_call.extend(__generate_full_maf_data_call(gps_call, obd_matrix, fuel_type=fuel_type))
+        return __generate_full_maf_data_columns(gps_times, obd_columns, fuel_type=fuel_type)
     else:
-        data_call.extend(__generate_full_fuel_data_call(gps_call, obd_matrix))
-    return data_call
+        return __generate_full_fuel_data_columns(gps_times, obd_columns)
 
 
 def load_tuples_csv_file(input_path):
@@ -352,17 +947,17 @@ def load_tuples_csv_file(input_path):
     return return_list
 
 
-def __generate_full_rpm_data_call(gps_call, obd_matrix, fuel_type=FuelTypes.GASOLINE.value,
-                                  volumetric_efficiency=DEFAULT_VOLUMETRIC_EFFICIENCY,
-                                  engine_displacement=DEFAULT_ENGINE_DISPLACEMENT):
-    """Generates a full data row for the drive matrix depending on the `obd_mode`
+def __generate_full_rpm_data_columns(gps_times, obd_columns, fuel_type=FuelTypes.GASOLINE.value,
+                                     volumetric_efficiency=DEFAULT_VOLUMETRIC_EFFICIENCY,
+                                     engine_displacement=DEFAULT_ENGINE_DISPLACEMENT):
+    """Generates the OBD data columns of the drive matrix for the RPM mode
 
     Parameters
     ----------
-    gps_call : List(Union[int,float])
-        A row from a GPS matrix
-    obd_matrix : List(List(Union[int,str,float]))
-        The OBD matrix
+    gps_times : numpy.ndarray
+        The times of the GPS calls
+    obd_columns : Dict[CommandNames, (numpy.ndarray, numpy.ndarray)]
+        The OBD columns, as loaded by `load_obd_columns()`
     fuel_type : FuelTypes enum value
         The fuel type used by the vehicle (the default is gasoline)
     volumetric_efficiency : int
@@ -372,120 +967,92 @@ def __generate_full_rpm_data_call(gps_call, obd_matrix, fuel_type=FuelTypes.GASO
 
     Returns
     ----------
-    List(List(Union[int,str,float]))
-        A full data call, compromised of time, latlong, speed, and obd information
-
-    Notes
-    --------
-    The runtime of this function can be vastly improved if the search for the closest obd call would be a binary
-    search instead of linear search
+    List(List(Union[int,float]))
+        The speed, RPM, MAP, IAT, MAF and fuel flow columns
     """
-    rpm_value = 0
-    rpm_time_diff = -1
-    map_value = 0
-    map_time_diff = -1
-    iat_value = 0.0
-    iat_time_diff = -1
-    speed_value = 0
-    speed_time_diff = -1
-    # Find the closest OBD calls to the time of the GPS call
-    for obd_call in obd_matrix:
-        if obd_call[1] == CommandNames.ENGINE_RPM.value:
-            if rpm_time_diff == -1 or abs(obd_call[0] - gps_call[0]) < rpm_time_diff:
-                rpm_time_diff = abs(obd_call[0] - gps_call[0])
-                rpm_value = obd_call[2]
-        elif obd_call[1] == CommandNames.INTAKE_MANIFOLD_PRESSURE.value:
-            if map_time_diff == -1 or abs(obd_call[0] - gps_call[0]) < rpm_time_diff:
-                map_time_diff = abs(obd_call[0] - gps_call[0])
-                map_value = obd_call[2]
-        elif obd_call[1] == CommandNames.AIR_INTAKE_TEMP.value:
-            if iat_time_diff == -1 or abs(obd_call[0] - gps_call[0]) < rpm_time_diff:
-                iat_time_diff = abs(obd_call[0] - gps_call[0])
-                iat_value = obd_call[2]
-        else:
-            if speed_time_diff == -1 or abs(obd_call[0] - gps_call[0]) < rpm_time_diff:
-                speed_time_diff = abs(obd_call[0] - gps_call[0])
-                speed_value = obd_call[2]
-    maf_value = calculate_maf(rpm_value, map_value, iat_value, volumetric_efficiency=volumetric_efficiency,
-                              engine_displacement=engine_displacement)
-    fuel_value = calculate_fuel_consumption(maf_value, fuel_type=fuel_type)
-    return [speed_value, rpm_value, map_value, iat_value, maf_value, fuel_value]
+    speed_values = __find_closest_obd_values(gps_times, obd_columns, CommandNames.SPEED, 0)
+    rpm_values = __find_closest_obd_values(gps_times, obd_columns, CommandNames.ENGINE_RPM, 0)
+    map_values = __find_closest_obd_values(gps_times, obd_columns, CommandNames.INTAKE_MANIFOLD_PRESSURE, 0)
+    iat_values = __find_closest_obd_values(gps_times, obd_columns, CommandNames.AIR_INTAKE_TEMP, 0.0)
+    maf_values = calculate_maf(rpm_values, map_values, iat_values, volumetric_efficiency=volumetric_efficiency,
+                               engine_displacement=engine_displacement)
+    fuel_values = calculate_fuel_consumption(maf_values, fuel_type=fuel_type)
+    return [speed_values.tolist(), rpm_values.tolist(), map_values.tolist(), iat_values.tolist(), maf_values.tolist(),
+            fuel_values.tolist()]
 
 
-def __generate_full_maf_data_call(gps_call, obd_matrix, fuel_type=FuelTypes.GASOLINE.value):
-    """Generates a full data row for the drive matrix depending on the `obd_mode`
+def __generate_full_maf_data_columns(gps_times, obd_columns, fuel_type=FuelTypes.GASOLINE.value):
+    """Generates the OBD data columns of the drive matrix for the MAF mode
 
     Parameters
     ----------
-    gps_call : List(Union[int,float])
-        A row from a GPS matrix
-    obd_matrix : List(List(Union[int,str,float]))
-        The OBD matrix
+    gps_times : numpy.ndarray
+        The times of the GPS calls
+    obd_columns : Dict[CommandNames, (numpy.ndarray, numpy.ndarray)]
+        The OBD columns, as loaded by `load_obd_columns()`
     fuel_type : FuelTypes enum value
         The fuel type used by the vehicle (the default is gasoline)
 
     Returns
     ----------
-    List(List(Union[int,str,float]))
-        A full data call, compromised of time, latlong, speed, and OBD information
-
-    Notes
-    --------
-    The runtime of this function can be vastly improved if the search for the closest obd call would be a binary
-    search instead of linear search
+    List(List(Union[int,float]))
+        The speed, MAF and fuel flow columns
     """
-    maf_value = 0.0
-    maf_time_diff = -1
-    speed_value = 0
-    speed_time_diff = -1
-    # Find the closest OBD calls to the time of the GPS call
-    for obd_call in obd_matrix:
-        if obd_call[1] == CommandNames.MAF.value:
-            if maf_time_diff == -1 or abs(obd_call[0] - gps_call[0]) < maf_time_diff:
-                maf_time_diff = abs(obd_call[0] - gps_call[0])
-                maf_value = obd_call[2]
-        else:
-            if speed_time_diff == -1 or abs(obd_call[0] - gps_call[0]) < speed_time_diff:
-                speed_time_diff = abs(obd_call[0] - gps_call[0])
-                speed_value = obd_call[2]
-    return [speed_value, maf_value, calculate_fuel_consumption(maf_value, fuel_type=fuel_type)]
+    speed_values = __find_closest_obd_values(gps_times, obd_columns, CommandNames.SPEED, 0)
+    maf_values = __find_closest_obd_values(gps_times, obd_columns, CommandNames.MAF, 0.0)
+    fuel_values = calculate_fuel_consumption(maf_values, fuel_type=fuel_type)
+    return [speed_values.tolist(), maf_values.tolist(), fuel_values.tolist()]
 
 
-def __generate_full_fuel_data_call(gps_call, obd_matrix):
-    """Generates a full data row for the drive matrix depending on the `obd_mode`
+def __generate_full_fuel_data_columns(gps_times, obd_columns):
+    """Generates the OBD data columns of the drive matrix for the FUEL mode
 
     Parameters
     ----------
-    gps_call : List(Union[int,float])
-        A row from a GPS matrix
-    obd_matrix : List(List(Union[int,str,float]))
-        The OBD matrix
+    gps_times : numpy.ndarray
+        The times of the GPS calls
+    obd_columns : Dict[CommandNames, (numpy.ndarray, numpy.ndarray)]
+        The OBD columns, as loaded by `load_obd_columns()`
 
     Returns
     ----------
-    List(List(Union[int,str,float]))
-        A full data call, compromised of time, latlong, speed, and the fuel flow
+    List(List(Union[int,float]))
+        The speed and fuel flow columns
+    """
+    speed_values = __find_closest_obd_values(gps_times, obd_columns, CommandNames.SPEED, 0)
+    fuel_consumption_values = __find_closest_obd_values(gps_times, obd_columns, CommandNames.FUEL_CONSUMPTION_RATE,
+                                                        0.0)
+    return [speed_values.tolist(), fuel_consumption_values.tolist()]
 
-    Notes
-    --------
-    The runtime of this function can be vastly improved if the search for the closest obd call would be a binary
-    search instead of linear search
+
+def __find_closest_obd_values(gps_times, obd_columns, command_name, default_value):
+    """Finds the values of the calls closest in time to every GPS time with a binary search
+
+    Parameters
+    ----------
+    gps_times : numpy.ndarray
+        The times of the GPS calls
+    obd_columns : Dict[CommandNames, (numpy.ndarray, numpy.ndarray)]
+        The OBD columns, as loaded by `load_obd_columns()`
+    command_name : CommandNames enum
+        The command to search in
+    default_value : Union[int,float]
+        The value to use if the command has no calls
+
+    Returns
+    ----------
+    numpy.ndarray
+        The value of the closest call for every GPS time, on a tie the earlier call is chosen
     """
-    fuel_consumption_value = 0.0
-    fuel_consumption_time_diff = -1
-    speed_value = 0
-    speed_time_diff = -1
-    # Find the closest OBD calls to the time of the GPS call
-    for obd_call in obd_matrix:
-        if obd_call[1] == CommandNames.FUEL_CONSUMPTION_RATE.value:
-            if fuel_consumption_time_diff == -1 or abs(obd_call[0] - gps_call[0]) < fuel_consumption_time_diff:
-                fuel_consumption_time_diff = abs(obd_call[0] - gps_call[0])
-                fuel_consumption_value = obd_call[2]
-        else:
-            if speed_time_diff == -1 or abs(obd_call[0] - gps_call[0]) < speed_time_diff:
-                speed_time_diff = abs(obd_call[0] - gps_call[0])
-                speed_value = obd_call[2]
-    return [speed_value, fuel_consumption_value]
+    if command_name not in obd_columns:
+        return np.full(len(gps_times), default_value)
+    times, values = obd_columns[command_name]
+    after = np.searchsorted(times, gps_times, side='left')
+    before = np.maximum(after - 1, 0)
+    after = np.minimum(after, len(times) - 1)
+    use_before = (gps_times > times[0]) & \
+                 ((gps_times > times[-1]) | (gps_times - times[before] <= times[after] - gps_times))
+    return values[np.where(use_before, before, after)]
 
 
 def save_tuples_to_csv(tuple_list, output_path, create=True):
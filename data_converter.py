@@ -1,25 +1,166 @@
-from pyperclip import copy
+import io
+from array import array
+from csv import reader
+from enum import Enum
 
-from csv_util import load_drive_file
+import numpy as np
+
+from geodesic import EARTH_RADIUS
 from util import OBDModes
 
 
+class GeoJSONGeometries(Enum):
+    POINTS = 1  # A Point feature for every row, with its speed
+    LINE_STRING = 2  # A single LineString feature of the whole drive, which can be simplified
+
+
+FEATURE_COLLECTION_START = '{"type": "FeatureCollection","features": [\n'
+FEATURE_SEPARATOR = ',\n'
+FEATURE_COLLECTION_END = '\n]}'
+COORDINATES_WRITE_SIZE = 4096  # LineString coordinates are joined and written this many at a time
+
+
 def drive_csv_to_separate_coordinates(input_path, has_header=True, obd_mode=OBDModes.MAF.value, delimiter=',',
                                       copy_result=True, add_wrappers=True, add_speed=True):
-    matrix = load_drive_file(input_path, has_header=has_header, delimiter=delimiter, obd_mode=obd_mode)
-    string = ''
-    if add_wrappers:
-        string += '{"type": "FeatureCollection","features": [\n'
-    for row in matrix:
-        string += '{"type": "Feature","properties": {'
-        if add_speed:
-            string += '"Speed":' + str(row[3])
-        string += '},"geometry": {"type": "Point","coordinates": ['
-        string += str(row[2]) + "," + str(row[1])  # Lat and long are reversed in the program for some reason
-        string += ']}},\n'
-    string = string[:-2]
-    if add_wrappers:
-        string += '\n]}'
+    """
+    Notes
+    --------
+    `obd_mode` is not used, the drive file columns are the same in every OBD mode. `write_drive_geojson()` writes the
+    same features to a file or a stream without holding the document in memory
+    """
+    output = io.StringIO()
+    write_drive_geojson(input_path, output, has_header=has_header, delimiter=delimiter, add_wrappers=add_wrappers,
+                        add_speed=add_speed)
+    string = output.getvalue()
     if copy_result:
+        from pyperclip import copy
         copy(string)
     return string
+
+
+def write_drive_geojson(input_path, output, has_header=True, delimiter=',', geometry=GeoJSONGeometries.POINTS.value,
+                        tolerance=0, add_wrappers=True, add_speed=True):
+    """Writes a drive file as GeoJSON, feature by feature, reading the drive file row by row
+
+    Parameters
+    ----------
+    input_path : str
+        The path of the drive file
+    output : Union[str, TextIO]
+        The path of the GeoJSON file, or a text stream to write to
+    has_header : bool, optional
+        Whether the drive file starts with a header line (the default is True)
+    delimiter : str, optional
+        The separating string in the drive file (the default is a comma)
+    geometry : GeoJSONGeometries enum value
+        Whether to write a Point for every row or a single LineString (the default is POINTS)
+    tolerance : float, optional
+        The Douglas-Peucker tolerance of the LineString in meters, 0 keeps every point (the default is 0)
+    add_wrappers : bool, optional
+        Whether to wrap the features in a FeatureCollection (the default is True)
+    add_speed : bool, optional
+        Whether to add the speed to the properties of every Point (the default is True)
+
+    Returns
+    ----------
+    int
+        The number of points written
+    """
+    if isinstance(output, str):
+        with open(output, 'w') as file:
+            return write_drive_geojson(input_path, file, has_header=has_header, delimiter=delimiter,
+                                       geometry=geometry, tolerance=tolerance, add_wrappers=add_wrappers,
+                                       add_speed=add_speed)
+    with open(input_path, 'r') as file:
+        csv_reader = reader(file, delimiter=delimiter)
+        if has_header:
+            next(csv_reader, None)
+        if add_wrappers:
+            output.write(FEATURE_COLLECTION_START)
+        if geometry == GeoJSONGeometries.LINE_STRING.value:
+            point_count = __write_line_string(csv_reader, output, tolerance)
+        else:
+            point_count = __write_points(csv_reader, output, add_speed)
+        if add_wrappers:
+            output.write(FEATURE_COLLECTION_END)
+    return point_count
+
+
+def __write_points(csv_reader, output, add_speed):
+    point_count = 0
+    for row in csv_reader:
+        if point_count:
+            output.write(FEATURE_SEPARATOR)
+        # Lat and long are reversed in GeoJSON
+        output.write('{"type": "Feature","properties": {' + ('"Speed":' + str(float(row[3])) if add_speed else '') +
+                     '},"geometry": {"type": "Point","coordinates": [' + str(float(row[2])) + "," +
+                     str(float(row[1])) + ']}}')
+        point_count += 1
+    return point_count
+
+
+def __write_line_string(csv_reader, output, tolerance):
+    lats = array('d')
+    lons = array('d')
+    for row in csv_reader:
+        lats.append(float(row[1]))
+        lons.append(float(row[2]))
+    if len(lats) < 2:  # A LineString needs two positions at least
+        return 0
+    kept = simplify_track(np.frombuffer(lats), np.frombuffer(lons), tolerance)
+    output.write('{"type": "Feature","properties": {},"geometry": {"type": "LineString","coordinates": [')
+    for start in range(0, len(kept), COORDINATES_WRITE_SIZE):
+        chunk = kept[start:start + COORDINATES_WRITE_SIZE].tolist()
+        output.write((',' if start else '') + ','.join('[' + str(lons[i]) + ',' + str(lats[i]) + ']' for i in chunk))
+    output.write(']}}')
+    return len(kept)
+
+
+def simplify_track(lats, lons, tolerance):
+    """Douglas-Peucker simplification of a track
+
+    The distances are measured on an equirectangular projection around the mean latitude of the track, which is
+    accurate to well under a percent over the extent of a drive
+
+    Parameters
+    ----------
+    lats : numpy.ndarray
+        The latitudes of the track
+    lons : numpy.ndarray
+        The longitudes of the track
+    tolerance : float
+        The largest distance in meters a removed point may be from the simplified track, 0 or less keeps every point
+
+    Returns
+    ----------
+    numpy.ndarray
+        The indexes of the kept points, in order, always including the first and the last
+    """
+    if tolerance <= 0 or len(lats) < 3:
+        return np.arange(len(lats))
+    y = np.radians(lats) * EARTH_RADIUS
+    x = np.radians(lons) * EARTH_RADIUS * np.cos(np.radians(np.mean(lats)))
+    kept = np.zeros(len(lats), dtype=bool)
+    kept[0] = kept[-1] = True
+    ranges = [(0, len(lats) - 1)]
+    while ranges:
+        first, last = ranges.pop()
+        if last - first < 2:
+            continue
+        distances = __distances_to_segment(x[first + 1:last], y[first + 1:last], x[first], y[first], x[last], y[last])
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            farthest += first + 1
+            kept[farthest] = True
+            ranges.append((first, farthest))
+            ranges.append((farthest, last))
+    return np.flatnonzero(kept)
+
+
+def __distances_to_segment(x, y, x1, y1, x2, y2):
+    dx = x2 - x1
+    dy = y2 - y1
+    length_sq = dx * dx + dy * dy
+    # The position of the closest point along the segment, a segment whose ends are equal is a point
+    t = np.clip(((x - x1) * dx + (y - y1) * dy) / length_sq, 0, 1) if length_sq else 0
+    return np.hypot(x - (x1 + t * dx), y - (y1 + t * dy))
@@ -0,0 +1,221 @@
+import hashlib
+import os
+
+import numpy as np
+
+from binary_drive import BINARY_DRIVE_EXTENSION
+from binary_drive import is_binary_drive_file
+from binary_drive import load_binary_drive_file
+from binary_drive import write_binary_drive_file
+from csv_util import load_drive_columns
+from csv_util import load_file_gps_points
+from spatial_index import CentersIndex
+from util import file_content_hash
+
+DEFAULT_MAX_BYTES = 1 << 30  # 1 GiB
+
+
+class DriveCache:
+    """An on disk cache of parsed drive files and of the closest center of every row, keyed by content
+
+    A file is known by the SHA-256 hash of its content, so a renamed or copied file is found in the cache and a changed
+    file never is. The parsed columns are keyed by the file hash and the parsing arguments, and the closest centers are
+    keyed by those and the hash of the centers, so new centers never get the assignments of old ones. Every entry is a
+    binary drive file, see `binary_drive.BinaryDrive`, which is mapped into memory instead of parsed.
+
+    Once the entries take more than `max_bytes`, the least recently used ones are removed. The last use of an entry is
+    its modification time, which is updated on every hit, so the order survives between runs and is shared by processes
+    using the same directory. An entry which can't be removed, like one which is mapped on Windows, is skipped. The
+    directory is scanned when the cache is opened and whenever the entries written since then take it over the cap, so
+    the entries other processes write are only counted from the next scan.
+
+    Parameters
+    ----------
+    cache_dir_path : str
+        The directory of the cache, created if it does not exist
+    max_bytes : int, optional
+        The size cap of the cache (the default is DEFAULT_MAX_BYTES)
+    """
+
+    def __init__(self, cache_dir_path, max_bytes=DEFAULT_MAX_BYTES):
+        if max_bytes < 0:
+            raise ValueError('max_bytes can not be negative')
+        self.cache_dir_path = cache_dir_path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.__file_hashes = {}  # (path, size, modification time) to content hash, so a file is hashed once per run
+        self.__total_bytes = 0  # The bytes the entries took at the last scan and those written since
+        os.makedirs(cache_dir_path, exist_ok=True)
+        self.__evict()  # The cap may be lower than the one the directory was filled with
+
+    def load_drive_columns(self, input_path, delimiter=',', has_header=True, obd_mode=None):
+        """`csv_util.load_drive_columns()` through the cache
+
+        Returns
+        -------
+        Dict[str, numpy.ndarray]
+            Every column by its name, in file order, read only
+        """
+        if is_binary_drive_file(input_path):
+            return load_drive_columns(input_path)
+        key = self.__drive_key(input_path, delimiter, has_header, obd_mode)
+        entry = self.__get(key)
+        if entry is None:
+            columns = load_drive_columns(input_path, delimiter=delimiter, has_header=has_header, obd_mode=obd_mode)
+            entry = self.__put(key, list(columns.keys()), list(columns.values()), obd_mode)
+        return entry
+
+    def load_gps_points(self, input_path, has_header=True):
+        """The latitudes and longitudes of a gps or drive file, what `csv_util.load_file_gps_points()` loads, through
+        the cache
+
+        Returns
+        -------
+        (numpy.ndarray, numpy.ndarray)
+            The latitudes and longitudes, read only
+        """
+        if is_binary_drive_file(input_path):
+            drive = load_binary_drive_file(input_path)
+            return drive.column(1), drive.column(2)
+        key = self.__entry_key('points', self.__file_hash(input_path), str(has_header))
+        entry = self.__get(key)
+        if entry is None:
+            with open(input_path, 'r') as file:
+                if has_header:
+                    file.readline()
+                has_rows = bool(file.readline())
+            try:
+                points = np.loadtxt(input_path, delimiter=',', usecols=(1, 2), skiprows=1 if has_header else 0,
+                                    ndmin=2, dtype=np.float64) if has_rows else np.zeros((0, 2))
+            except ValueError:
+                points = np.array(load_file_gps_points(input_path, has_header=has_header),
+                                  dtype=np.float64).reshape(-1, 2)
+            entry = self.__put(key, ['Latitude', 'Longitude'], [points[:, 0], points[:, 1]])
+        return entry['Latitude'], entry['Longitude']
+
+    def closest_centers(self, input_path, centers_list, centers_index=None, delimiter=',', has_header=True,
+                        obd_mode=None):
+        """The closest center of every row of a drive file, and its distance, through the cache
+
+        Parameters
+        ----------
+        input_path : str
+            The path of the drive file
+        centers_list : List[(float, float)]
+            The latlong tuples of the centers
+        centers_index : spatial_index.CentersIndex, optional
+            The index of `centers_list`, it is built from `centers_list` only on a miss if not given
+        delimiter, has_header, obd_mode
+            As `csv_util.load_drive_columns()` takes them
+
+        Returns
+        -------
+        (numpy.ndarray, numpy.ndarray)
+            The index in `centers_list` of the closest center of every row, and its distance in meters, read only
+        """
+        key = self.__entry_key('centers', self.__drive_key(input_path, delimiter, has_header, obd_mode),
+                               centers_hash(centers_list))
+        entry = self.__get(key)
+        if entry is None:
+            columns = list(self.load_drive_columns(input_path, delimiter=delimiter, has_header=has_header,
+                                                   obd_mode=obd_mode).values())
+            if centers_index is None:
+                centers_index = CentersIndex(centers_list)
+            center_indexes, center_distances = centers_index.query(np.column_stack((columns[1], columns[2])))
+            entry = self.__put(key, ['Center', 'Distance'], [center_indexes, center_distances])
+        return entry['Center'], entry['Distance']
+
+    def size(self):
+        """The bytes the entries take"""
+        return sum(os.path.getsize(path) for path in self.__entry_paths())
+
+    def clear(self):
+        """Removes every entry"""
+        for path in self.__entry_paths():
+            self.__remove(path)
+        self.__total_bytes = 0
+
+    def __drive_key(self, input_path, delimiter, has_header, obd_mode):
+        return self.__entry_key('drive', self.__file_hash(input_path), delimiter, str(has_header), str(obd_mode))
+
+    def __file_hash(self, input_path):
+        stat = os.stat(input_path)
+        stat_key = (os.path.abspath(input_path), stat.st_size, stat.st_mtime_ns)
+        if stat_key not in self.__file_hashes:
+            self.__file_hashes[stat_key] = file_content_hash(input_path)
+        return self.__file_hashes[stat_key]
+
+    def __get(self, key):
+        path = os.path.join(self.cache_dir_path, key + BINARY_DRIVE_EXTENSION)
+        try:
+            entry = load_binary_drive_file(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            # A missing entry, or one which was removed or cut while it was read
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry.columns
+
+    def __put(self, key, names, columns, obd_mode=None):
+        path = os.path.join(self.cache_dir_path, key + BINARY_DRIVE_EXTENSION)
+        # Written under a name of its own, so a reader never maps a partly written entry
+        temporary_path = path + '.' + str(os.getpid()) + '.tmp'
+        write_binary_drive_file(temporary_path, names, columns, obd_mode=obd_mode)
+        self.__total_bytes += os.path.getsize(temporary_path)
+        os.replace(temporary_path, path)
+        if self.__total_bytes > self.max_bytes:
+            self.__evict()
+        if os.path.isfile(path):
+            return load_binary_drive_file(path).columns
+        # The entry alone is over the cap, so it was removed as soon as it was written
+        return {name: np.asarray(column) for name, column in zip(names, columns)}
+
+    def __evict(self):
+        entries = []
+        for path in self.__entry_paths():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        self.__total_bytes = sum(entry[1] for entry in entries)
+        for _, entry_size, path in sorted(entries):
+            if self.__total_bytes <= self.max_bytes:
+                break
+            if self.__remove(path):
+                self.__total_bytes -= entry_size
+
+    def __entry_paths(self):
+        return [os.path.join(self.cache_dir_path, filename) for filename in os.listdir(self.cache_dir_path)
+                if filename.endswith(BINARY_DRIVE_EXTENSION)]
+
+    @staticmethod
+    def __entry_key(*parts):
+        return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def __remove(path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+
+def centers_hash(centers_list):
+    """The SHA-256 hash of the centers, as a hex string, the same for equal centers in any container
+
+    Parameters
+    ----------
+    centers_list : Union[List[(float, float)], numpy.ndarray]
+        The latlong tuples of the centers
+
+    Returns
+    ----------
+    str
+        The hash
+    """
+    centers = np.ascontiguousarray(np.asarray(centers_list, dtype='<f8').reshape(-1, 2))
+    return hashlib.sha256(centers.tobytes()).hexdigest()
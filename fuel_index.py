@@ -0,0 +1,213 @@
+import csv
+import os
+
+import numpy as np
+
+from binary_drive import is_binary_drive_file
+from binary_drive import load_binary_drive_file
+from geodesic import point_to_points
+from util import MILLIS_IN_HOUR
+from util import calculate_segment_costs
+
+
+class FuelIndex:
+    """The cumulative fuel of a drive, for the fuel used between any two rows or times without integrating again
+
+    `cumulative_fuel[i]` is the fuel used from the first row to row i, integrated with the trapezoid rule of
+    `util.calculate_cost()`, so the fuel between two rows is a single subtraction, and the fuel between two times is
+    found with a binary search over `times`. Times inside a segment interpolate its fuel consumption rate linearly,
+    which is what the trapezoid rule integrates.
+
+    Parameters
+    ----------
+    times : Union[List[int], numpy.ndarray]
+        The times of the rows in milliseconds, rows out of time order are sorted, keeping the order of equal times
+    fcrs : Union[List[float], numpy.ndarray]
+        The fuel consumption rates of the rows
+    points : Union[List[(float, float)], numpy.ndarray], optional
+        The latlong tuples of the rows, needed only by `fuel_between_points()`
+    """
+
+    def __init__(self, times, fcrs, points=None):
+        times = np.asarray(times, dtype=np.int64)
+        fcrs = np.asarray(fcrs, dtype=np.float64)
+        order = np.argsort(times, kind='stable') if np.any(np.diff(times) < 0) else slice(None)
+        self.times = times[order]
+        self.fcrs = fcrs[order]
+        self.points = None if points is None else np.asarray(points, dtype=np.float64).reshape(-1, 2)[order]
+        self.cumulative_fuel = np.zeros(len(self.times))
+        np.cumsum(calculate_segment_costs(self.times, self.fcrs), out=self.cumulative_fuel[1:])
+
+    @classmethod
+    def from_file(cls, input_path, has_headers=True):
+        """Builds the index of a CSV or binary drive file, reading it the same way `util.calculate_csv_fuel_cost()` does
+
+        Parameters
+        ----------
+        input_path : str
+            The path of the drive file
+        has_headers : bool, optional
+            Whether the file starts with a header line (the default is True)
+
+        Returns
+        ----------
+        FuelIndex
+            The index, with the points of the rows
+        """
+        if is_binary_drive_file(input_path):
+            drive = load_binary_drive_file(input_path)
+            return cls(drive.column(0), drive.column(-1), drive.points())
+        times = []
+        fcrs = []
+        points = []
+        with open(input_path, 'r') as file:
+            if has_headers:
+                next(file, None)
+            for line in file:
+                linesplit = line.split(',')
+                times.append(int(linesplit[0]))
+                points.append((float(linesplit[1]), float(linesplit[2])))
+                fcrs.append(float(linesplit[-1]))
+        return cls(times, fcrs, points)
+
+    def __len__(self):
+        return len(self.times)
+
+    def total(self):
+        """The fuel used over the whole drive, the same sum `util.calculate_csv_fuel_cost()` gives for a drive in time
+        order
+        """
+        return self.cumulative_fuel[-1].item() if len(self.times) else 0.0
+
+    def fuel_between_rows(self, start_row, end_row):
+        """The fuel used from one row to another, in O(1)
+
+        Parameters
+        ----------
+        start_row : Union[int, numpy.ndarray]
+            The row the range starts at
+        end_row : Union[int, numpy.ndarray]
+            The row the range ends at, inclusive
+
+        Returns
+        ----------
+        Union[float, numpy.ndarray]
+            The fuel, negative if `end_row` comes before `start_row`
+        """
+        fuel = self.cumulative_fuel[end_row] - self.cumulative_fuel[start_row]
+        return fuel.item() if np.ndim(fuel) == 0 else fuel
+
+    def fuel_between_times(self, start_time, end_time):
+        """The fuel used from one time to another, in O(log n), times outside the drive are clamped to it
+
+        Parameters
+        ----------
+        start_time : Union[int, numpy.ndarray]
+            The time the range starts at in milliseconds
+        end_time : Union[int, numpy.ndarray]
+            The time the range ends at in milliseconds
+
+        Returns
+        ----------
+        Union[float, numpy.ndarray]
+            The fuel, negative if `end_time` comes before `start_time`
+        """
+        fuel = self.cumulative_fuel_at(end_time) - self.cumulative_fuel_at(start_time)
+        return fuel.item() if np.ndim(fuel) == 0 else fuel
+
+    def fuel_between_points(self, start, end):
+        """The fuel used between the rows closest to two points, over the same rows
+        `util.get_drive_between_two_points()` returns
+
+        Parameters
+        ----------
+        start : (float, float)
+            A latlong tuple
+        end : (float, float)
+            A latlong tuple
+
+        Returns
+        ----------
+        float
+            The fuel, 0 if the rows are empty
+        """
+        if self.points is None:
+            raise ValueError('The index was built without points')
+        start_row = int(np.argmin(point_to_points(start, self.points)))
+        end_row = int(np.argmin(point_to_points(end, self.points)))
+        # The slice of get_drive_between_two_points() stops before the end row
+        return self.fuel_between_rows(start_row, end_row - 1) if end_row - 1 > start_row else 0.0
+
+    def cumulative_fuel_at(self, time):
+        """The fuel used from the start of the drive to a time
+
+        Parameters
+        ----------
+        time : Union[int, numpy.ndarray]
+            The time in milliseconds
+
+        Returns
+        ----------
+        numpy.ndarray
+            The fuel
+        """
+        time = np.asarray(time, dtype=np.int64)
+        if len(self.times) < 2:
+            return np.zeros(time.shape)
+        time = np.clip(time, self.times[0], self.times[-1])
+        # The segment which holds the time, the last one for the last time
+        segment = np.minimum(np.searchsorted(self.times, time, side='right') - 1, len(self.times) - 2)
+        segment_start = self.times[segment]
+        segment_duration = self.times[segment + 1] - segment_start
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fraction = np.where(segment_duration > 0, (time - segment_start) / segment_duration, 0)
+        fcr = self.fcrs[segment] + (self.fcrs[segment + 1] - self.fcrs[segment]) * fraction
+        # util.calculate_cost() of the part of the segment before the time
+        time_in_hours = (time - segment_start) / MILLIS_IN_HOUR
+        high = np.maximum(fcr, self.fcrs[segment])
+        low = np.minimum(fcr, self.fcrs[segment])
+        return self.cumulative_fuel[segment] + low * time_in_hours + ((high - low) * time_in_hours) / 2
+
+
+def fleet_fuel_report(input_dir_path, start_time=None, end_time=None, has_headers=True, output_path=None):
+    """The fuel used by every drive in a directory, optionally only inside a time window
+
+    Parameters
+    ----------
+    input_dir_path : str
+        The path of the directory which holds the drive files
+    start_time : int, optional
+        The time the window starts at in milliseconds (the default is the start of every drive)
+    end_time : int, optional
+        The time the window ends at in milliseconds (the default is the end of every drive)
+    has_headers : bool, optional
+        Whether the files start with a header line (the default is True)
+    output_path : str, optional
+        A CSV file to save the report to, with a total line at the end (the default is not saving it)
+
+    Returns
+    ----------
+    List[(str, int, int, float)]
+        The file name, first time, last time and fuel of every drive, in file name order
+    """
+    report = []
+    for filename in sorted(os.listdir(input_dir_path)):
+        fuel_index = FuelIndex.from_file(os.path.join(input_dir_path, filename), has_headers=has_headers)
+        if not len(fuel_index):
+            report.append((filename, 0, 0, 0.0))
+            continue
+        first_time, last_time = fuel_index.times[0].item(), fuel_index.times[-1].item()
+        if start_time is None and end_time is None:
+            fuel = fuel_index.total()
+        else:
+            window_start = first_time if start_time is None else max(start_time, first_time)
+            window_end = last_time if end_time is None else min(end_time, last_time)
+            fuel = fuel_index.fuel_between_times(window_start, window_end) if window_end > window_start else 0.0
+        report.append((filename, first_time, last_time, fuel))
+    if output_path:
+        with open(output_path, 'w+', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['File', 'Start Time', 'End Time', 'Fuel'])
+            writer.writerows(report)
+            writer.writerow(['Total', '', '', sum(row[3] for row in report)])
+    return report
@@ -0,0 +1,182 @@
+from enum import Enum
+
+import numpy as np
+
+
+class DistanceModes(Enum):
+    HAVERSINE = 1  # Great circle on a sphere, fastest, up to ~0.5% off the geodesic
+    ELLIPSOIDAL = 2  # Vincenty on the WGS-84 ellipsoid, within 1 mm of geopy.distance.distance
+
+
+EARTH_RADIUS = 6371009  # m, the mean radius geopy uses for great circle distances
+WGS84_MAJOR_AXIS = 6378137.0  # m
+WGS84_FLATTENING = 1 / 298.257223563
+WGS84_MINOR_AXIS = WGS84_MAJOR_AXIS * (1 - WGS84_FLATTENING)  # m
+
+VINCENTY_TOLERANCE = 1e-12  # radians
+VINCENTY_MAX_ITERATIONS = 200
+
+
+def point_to_points(point, points, mode=DistanceModes.ELLIPSOIDAL.value):
+    """Distances from a single point to many points
+
+    Parameters
+    ----------
+    point : (float, float)
+        A latlong tuple
+    points : Union[List[(float, float)], numpy.ndarray]
+        Latlong tuples, or an array of shape (n, 2)
+    mode : DistanceModes enum value
+        The distance formula (the default is ELLIPSOIDAL)
+
+    Returns
+    ----------
+    numpy.ndarray
+        The distance from `point` to every point in `points` in meters
+    """
+    points = __as_points_array(points)
+    return __distances(point[0], point[1], points[:, 0], points[:, 1], mode)
+
+
+def paired_distances(points_a, points_b, mode=DistanceModes.ELLIPSOIDAL.value):
+    """Distances between the points of two equally long lists, position by position
+
+    Parameters
+    ----------
+    points_a : Union[List[(float, float)], numpy.ndarray]
+        Latlong tuples, or an array of shape (n, 2)
+    points_b : Union[List[(float, float)], numpy.ndarray]
+        Latlong tuples, or an array of shape (n, 2)
+    mode : DistanceModes enum value
+        The distance formula (the default is ELLIPSOIDAL)
+
+    Returns
+    ----------
+    numpy.ndarray
+        The distance from `points_a[i]` to `points_b[i]` in meters for every i
+    """
+    points_a = __as_points_array(points_a)
+    points_b = __as_points_array(points_b)
+    return __distances(points_a[:, 0], points_a[:, 1], points_b[:, 0], points_b[:, 1], mode)
+
+
+def consecutive_distances(points, mode=DistanceModes.ELLIPSOIDAL.value):
+    """Distances between every point and the point after it
+
+    Parameters
+    ----------
+    points : Union[List[(float, float)], numpy.ndarray]
+        Latlong tuples, or an array of shape (n, 2)
+    mode : DistanceModes enum value
+        The distance formula (the default is ELLIPSOIDAL)
+
+    Returns
+    ----------
+    numpy.ndarray
+        n - 1 distances in meters, the i-th is between `points[i]` and `points[i + 1]`
+    """
+    points = __as_points_array(points)
+    return paired_distances(points[:-1], points[1:], mode=mode)
+
+
+def many_to_many(points_a, points_b, mode=DistanceModes.ELLIPSOIDAL.value):
+    """Distances between every point of one list and every point of another
+
+    Parameters
+    ----------
+    points_a : Union[List[(float, float)], numpy.ndarray]
+        n latlong tuples, or an array of shape (n, 2)
+    points_b : Union[List[(float, float)], numpy.ndarray]
+        m latlong tuples, or an array of shape (m, 2)
+    mode : DistanceModes enum value
+        The distance formula (the default is ELLIPSOIDAL)
+
+    Returns
+    ----------
+    numpy.ndarray
+        An (n, m) matrix of distances in meters
+
+    Notes
+    --------
+    The matrix and its intermediate arrays take about 20 * n * m floats, so large inputs should be split into chunks of
+    `points_a` by the caller
+    """
+    points_a = __as_points_array(points_a)
+    points_b = __as_points_array(points_b)
+    return __distances(points_a[:, 0, None], points_a[:, 1, None], points_b[None, :, 0], points_b[None, :, 1], mode)
+
+
+def __as_points_array(points):
+    return np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+
+def __distances(lat1, lon1, lat2, lon2, mode):
+    if mode == DistanceModes.HAVERSINE.value:
+        return __haversine(lat1, lon1, lat2, lon2)
+    return __vincenty(lat1, lon1, lat2, lon2)
+
+
+def __haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+def __vincenty(lat1, lon1, lat2, lon2):
+    """Vincenty's inverse formula, evaluated for all the point pairs at once
+
+    Notes
+    --------
+    Every pair stops iterating once it converges, so its distance doesn't depend on the other pairs it was computed
+    with. Nearly antipodal pairs, which the formula does not converge on, fall back to the haversine distance. Points
+    along a drive are never nearly antipodal
+    """
+    f = WGS84_FLATTENING
+    # The reduced latitudes are computed before broadcasting, once per point instead of once per pair
+    u1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    u2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    sin_u1, cos_u1, sin_u2, cos_u2, longitude_diff = np.broadcast_arrays(
+        np.sin(u1), np.cos(u1), np.sin(u2), np.cos(u2), np.radians(lon2) - np.radians(lon1))
+    shape = longitude_diff.shape
+    sin_u1, cos_u1, sin_u2, cos_u2 = sin_u1.ravel(), cos_u1.ravel(), sin_u2.ravel(), cos_u2.ravel()
+    longitude_diff = longitude_diff.ravel()
+    lambda_ = longitude_diff.copy()
+    sigma = np.zeros(shape).ravel()
+    sin_sigma = np.zeros(shape).ravel()
+    cos_sigma = np.zeros(shape).ravel()
+    cos_sq_alpha = np.zeros(shape).ravel()
+    cos_2sigma_m = np.zeros(shape).ravel()
+    active = np.arange(len(lambda_))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(VINCENTY_MAX_ITERATIONS):
+            if not len(active):
+                break
+            a_sin_u1, a_cos_u1, a_sin_u2, a_cos_u2 = sin_u1[active], cos_u1[active], sin_u2[active], cos_u2[active]
+            sin_lambda, cos_lambda = np.sin(lambda_[active]), np.cos(lambda_[active])
+            a_sin_sigma = np.hypot(a_cos_u2 * sin_lambda, a_cos_u1 * a_sin_u2 - a_sin_u1 * a_cos_u2 * cos_lambda)
+            a_cos_sigma = a_sin_u1 * a_sin_u2 + a_cos_u1 * a_cos_u2 * cos_lambda
+            a_sigma = np.arctan2(a_sin_sigma, a_cos_sigma)
+            sin_alpha = np.where(a_sin_sigma == 0, 0, a_cos_u1 * a_cos_u2 * sin_lambda / a_sin_sigma)
+            a_cos_sq_alpha = 1 - sin_alpha ** 2
+            # Both points on the equator
+            a_cos_2sigma_m = np.where(a_cos_sq_alpha == 0, 0,
+                                      a_cos_sigma - 2 * a_sin_u1 * a_sin_u2 / a_cos_sq_alpha)
+            c = f / 16 * a_cos_sq_alpha * (4 + f * (4 - 3 * a_cos_sq_alpha))
+            new_lambda = longitude_diff[active] + (1 - c) * f * sin_alpha * (
+                    a_sigma + c * a_sin_sigma * (a_cos_2sigma_m + c * a_cos_sigma * (-1 + 2 * a_cos_2sigma_m ** 2)))
+            sigma[active], sin_sigma[active], cos_sigma[active] = a_sigma, a_sin_sigma, a_cos_sigma
+            cos_sq_alpha[active], cos_2sigma_m[active] = a_cos_sq_alpha, a_cos_2sigma_m
+            converged = np.abs(new_lambda - lambda_[active]) < VINCENTY_TOLERANCE
+            lambda_[active] = new_lambda
+            active = active[~converged]
+        u_sq = cos_sq_alpha * (WGS84_MAJOR_AXIS ** 2 - WGS84_MINOR_AXIS ** 2) / WGS84_MINOR_AXIS ** 2
+        a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+        b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+        delta_sigma = b * sin_sigma * (cos_2sigma_m + b / 4 * (
+                cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) -
+                b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+        result = WGS84_MINOR_AXIS * a * (sigma - delta_sigma)
+    if len(active):
+        lat1, lon1, lat2, lon2 = [np.broadcast_to(x, shape).ravel()[active] for x in (lat1, lon1, lat2, lon2)]
+        result[active] = __haversine(lat1, lon1, lat2, lon2)
+    return result.reshape(shape)
@@ -1,59 +1,386 @@
 import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from multiprocessing.shared_memory import SharedMemory
 from random import sample
 
-from geopy import distance
+import numpy as np
 
+from csv_util import iterate_dir_gps_points
 from csv_util import save_tuples_to_csv
+from geodesic import DistanceModes
+from geodesic import consecutive_distances
+from geodesic import many_to_many
+from geodesic import paired_distances
+from geodesic import point_to_points
+
+DEFAULT_CHUNK_SIZE = 1024
+DEFAULT_BATCH_SIZE = 1024
+DEFAULT_BUFFER_SIZE = 65536
+REDUCTION_BLOCK_SIZE = 65536  # points, the fixed unit of work of the parallel assignment
 
 
 def normalize(tuple_list, route_length, distance_between_points, iteration_count, print_logs=True,
-              save=False, save_dir_path=''):
-    centers_list = sample(set(tuple_list), int(route_length / distance_between_points))
+              save=False, save_dir_path='', chunk_size=DEFAULT_CHUNK_SIZE, tolerance=0,
+              distance_mode=DistanceModes.ELLIPSOIDAL.value, workers=1):
+    """Finds evenly spread centers for the GPS points of a route with k-means
+
+    Parameters
+    ----------
+    tuple_list : List[(float, float)]
+        The GPS points of all the drives along the route
+    route_length : float
+        The length of the route in km
+    distance_between_points : float
+        The wanted distance between two centers in km, sets the number of centers
+    iteration_count : int
+        The maximal number of k-means iterations
+    print_logs : bool
+        Print logs while the function is running (the default is True)
+    save : bool
+        Save the initial centers and the centers after every iteration (the default is False)
+    save_dir_path : str
+        The directory to save the centers in (the default is the working directory)
+    chunk_size : int
+        The number of points whose distances to all the centers are computed at once, which caps the memory at about
+        20 * `chunk_size` * number of centers floats (the default is 1024)
+    tolerance : float
+        Stop before `iteration_count` once no center moves more than this many meters in an iteration (the default is
+        0, which always runs `iteration_count` iterations)
+    distance_mode : DistanceModes enum value
+        The distance formula used to assign points to centers, HAVERSINE is over 10 times faster (the default is
+        ELLIPSOIDAL)
+    workers : int
+        The number of processes assigning points at the same time, 1 assigns them in the calling process (the default
+        is 1). The workers read the points from shared memory, and the centers are the same for any number of workers
+
+    Returns
+    -------
+    List[(float, float)]
+        The centers as latlong tuples
+    """
+    centers_list = sample(list(set(tuple_list)), int(route_length / distance_between_points))
+    points = np.asarray(tuple_list, dtype=np.float64).reshape(-1, 2)
     if save:
         save_tuples_to_csv(centers_list, os.path.join(save_dir_path, 'Initial Choice.csv'))
+    shared_points = None
+    executor = None
+    if workers > 1:
+        shared_points = SharedMemory(create=True, size=max(points.nbytes, 1))
+        np.ndarray(points.shape, dtype=points.dtype, buffer=shared_points.buf)[:] = points
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=__attach_shared_points,
+                                       initargs=(shared_points.name, points.shape))
+    try:
+        for i in range(iteration_count):
+            if print_logs:
+                print('Iteration ' + str(i))
+            centers_list, max_movement = __iteration_with_all_points(points, centers_list, chunk_size=chunk_size,
+                                                                     distance_mode=distance_mode, executor=executor)
+            if print_logs:
+                print('The centers moved up to ' + str(max_movement) + 'm')
+            if save:
+                save_tuples_to_csv(centers_list, os.path.join(save_dir_path, 'Iteration ' + str(i) + '.csv'))
+            if max_movement < tolerance:
+                break
+    finally:
+        if executor is not None:
+            executor.shutdown()
+            shared_points.close()
+            shared_points.unlink()
+    return centers_list
+
+
+def __iteration_with_all_points(points, centers_list, chunk_size=DEFAULT_CHUNK_SIZE,
+                                distance_mode=DistanceModes.ELLIPSOIDAL.value, executor=None):
+    """A single k-means iteration, assigns every point to its closest center and moves the centers to their means
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        The points as an (n, 2) latlong array
+    centers_list : List[(float, float)]
+        The current centers
+    chunk_size : int
+        The number of points whose distances to all the centers are computed at once (the default is 1024)
+    distance_mode : DistanceModes enum value
+        The distance formula used to assign points to centers (the default is ELLIPSOIDAL)
+    executor : concurrent.futures.ProcessPoolExecutor , optional
+        A pool whose workers attached the points with `__attach_shared_points()`, to assign the blocks of points in
+        (the default is assigning them in the calling process)
+
+    Returns
+    -------
+    (List[(float, float)], float)
+        The new centers, in the order of the current ones and without those no point was assigned to, and the largest
+        distance in meters a center moved
+
+    Notes
+    --------
+    The points are split into blocks of `REDUCTION_BLOCK_SIZE` whatever the number of workers is, and the partial sums
+    of the blocks are added in block order, so the floating point result doesn't depend on the number of workers
+    """
+    centers = np.asarray(centers_list, dtype=np.float64).reshape(-1, 2)
+    blocks = [(start, min(start + REDUCTION_BLOCK_SIZE, len(points)))
+              for start in range(0, len(points), REDUCTION_BLOCK_SIZE)]
+    if executor is None:
+        partial_sums = (__block_partial_sums(points, start, stop, centers, chunk_size, distance_mode)
+                        for start, stop in blocks)
+    else:
+        partial_sums = executor.map(__shared_block_partial_sums, [block[0] for block in blocks],
+                                    [block[1] for block in blocks], [centers] * len(blocks),
+                                    [chunk_size] * len(blocks), [distance_mode] * len(blocks))
+    counts = np.zeros(len(centers), dtype=np.int64)
+    sums = np.zeros((len(centers), 2))
+    for block_counts, block_sums in partial_sums:
+        counts += block_counts
+        sums += block_sums
+    assigned = counts != 0
+    new_centers = sums[assigned] / counts[assigned, None]
+    movements = paired_distances(centers[assigned], new_centers)
+    return [(lat, lon) for lat, lon in new_centers.tolist()], float(movements.max()) if len(movements) else 0.0
+
+
+def __block_partial_sums(points, start, stop, centers, chunk_size, distance_mode):
+    """Assigns the points of a block to their closest centers
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray)
+        The number of points assigned to every center and the (k, 2) sums of their latlongs
+    """
+    assignments = np.empty(stop - start, dtype=np.int64)
+    for chunk_start in range(start, stop, chunk_size):
+        chunk_stop = min(chunk_start + chunk_size, stop)
+        # argmin picks the first of equally close centers, so a repeated center never gets points
+        assignments[chunk_start - start:chunk_stop - start] = np.argmin(
+            many_to_many(points[chunk_start:chunk_stop], centers, mode=distance_mode), axis=1)
+    counts = np.bincount(assignments, minlength=len(centers))
+    sums = np.column_stack((np.bincount(assignments, weights=points[start:stop, 0], minlength=len(centers)),
+                            np.bincount(assignments, weights=points[start:stop, 1], minlength=len(centers))))
+    return counts, sums
+
+
+# The shared memory points of a pool worker process, set by `__attach_shared_points()`
+__worker_shared_points = {}
+
+
+def __attach_shared_points(shared_memory_name, shape):
+    shared_memory = SharedMemory(name=shared_memory_name)
+    __worker_shared_points['shared_memory'] = shared_memory  # keeps the buffer alive while the array is used
+    __worker_shared_points['points'] = np.ndarray(shape, dtype=np.float64, buffer=shared_memory.buf)
+
+
+def __shared_block_partial_sums(start, stop, centers, chunk_size, distance_mode):
+    return __block_partial_sums(__worker_shared_points['points'], start, stop, centers, chunk_size, distance_mode)
+
+
+def normalize_dir_mini_batch(input_dir_path, route_length, distance_between_points, iteration_count, has_header=True,
+                             batch_size=DEFAULT_BATCH_SIZE, buffer_size=DEFAULT_BUFFER_SIZE, tolerance=0,
+                             distance_mode=DistanceModes.ELLIPSOIDAL.value, seed=None, print_logs=True, save=False,
+                             save_dir_path='', drive_cache=None):
+    """Finds evenly spread centers for the GPS points of the drives in a directory with mini-batch k-means, reading the
+    points from the files instead of holding them all in memory
+
+    Parameters
+    ----------
+    input_dir_path : str
+        The directory of the gps or drive files
+    route_length : float
+        The length of the route in km
+    distance_between_points : float
+        The wanted distance between two centers in km, sets the number of centers
+    iteration_count : int
+        The maximal number of passes over the points
+    has_header : bool
+        Does the files in the directory have headers (the default is True)
+    batch_size : int
+        The number of points the centers are updated with at a time (the default is 1024)
+    buffer_size : int
+        The number of points held in memory to draw the random batches from (the default is 65536)
+    tolerance : float
+        Stop before `iteration_count` once no center moves more than this many meters in a pass (the default is 0,
+        which always runs `iteration_count` passes)
+    distance_mode : DistanceModes enum value
+        The distance formula used to assign points to centers (the default is ELLIPSOIDAL)
+    seed : int , optional
+        The seed of the random choices, for repeatable results (the default is a random seed)
+    print_logs : bool
+        Print logs while the function is running (the default is True)
+    save : bool
+        Save the initial centers and the centers after every pass (the default is False)
+    save_dir_path : str
+        The directory to save the centers in (the default is the working directory)
+    drive_cache : drive_cache.DriveCache , optional
+        The cache of the points of the files, so every pass and every later run parses only new or changed files (the
+        default is parsing every file on every pass)
+
+    Returns
+    -------
+    List[(float, float)]
+        The centers as latlong tuples, without centers no point was assigned to
+
+    Notes
+    --------
+    Every pass reads the files in a random order through a shuffling buffer, and every center moves to the mean of all
+    the points it was assigned so far, so its learning rate drops as 1 / its point count. The memory depends on
+    `buffer_size` and the number of centers only, and a pass takes linear time in the number of points.
+
+    See Also
+    -------
+    `normalize()` for the version which holds all the points in memory
+    """
+    rng = np.random.default_rng(seed)
+    filenames = sorted(os.listdir(input_dir_path))
+    centers = __reservoir_sample(iterate_dir_gps_points(input_dir_path, has_header=has_header, filenames=filenames,
+                                                        drive_cache=drive_cache),
+                                 int(route_length / distance_between_points), rng)
+    counts = np.zeros(len(centers), dtype=np.int64)
+    if save:
+        save_tuples_to_csv(centers.tolist(), os.path.join(save_dir_path, 'Initial Choice.csv'))
     for i in range(iteration_count):
         if print_logs:
             print('Iteration ' + str(i))
-        centers_list = __iteration_with_all_points(tuple_list, centers_list, print_logs=print_logs)
+        previous_centers = centers.copy()
+        rng.shuffle(filenames)
+        points = iterate_dir_gps_points(input_dir_path, has_header=has_header, filenames=filenames,
+                                        drive_cache=drive_cache)
+        for batch in __random_batches(points, batch_size, buffer_size, rng):
+            assignments = np.argmin(many_to_many(batch, centers, mode=distance_mode), axis=1)
+            batch_counts = np.bincount(assignments, minlength=len(centers))
+            updated = batch_counts != 0
+            new_counts = counts + batch_counts
+            for axis in range(2):
+                sums = np.bincount(assignments, weights=batch[:, axis], minlength=len(centers))
+                centers[updated, axis] = (centers[updated, axis] * counts[updated] + sums[updated]) / \
+                    new_counts[updated]
+            counts = new_counts
+        max_movement = float(paired_distances(previous_centers, centers).max()) if len(centers) else 0.0
+        if print_logs:
+            print('The centers moved up to ' + str(max_movement) + 'm')
         if save:
-            save_tuples_to_csv(centers_list, os.path.join(save_dir_path, 'Iteration ' + str(i) + '.csv'))
-    return centers_list
+            save_tuples_to_csv(centers[counts != 0].tolist(),
+                               os.path.join(save_dir_path, 'Iteration ' + str(i) + '.csv'))
+        if max_movement < tolerance:
+            break
+    return [(lat, lon) for lat, lon in centers[counts != 0].tolist()]
 
 
-def __iteration_with_all_points(tuple_list, centers_list, print_logs=True):
-    centers_dict = {center: [] for center in centers_list}
-    length = len(tuple_list)
-    for i in range(length):
-        if print_logs:
-            print(length - i)
-        min_dist = distance.distance(tuple_list[i], centers_list[0])
-        current_center = centers_list[0]
-        for j in range(1, len(centers_list)):
-            if distance.distance(tuple_list[i], centers_list[j]) < min_dist:
-                min_dist = distance.distance(tuple_list[i], centers_list[j])
-                current_center = centers_list[j]
-        centers_dict[current_center].append(tuple_list[i])
-    return_list = []
-    for key in centers_dict:
-        length = len(centers_dict[key])
-        if length != 0:
-            lat_sum = sum([x[0] for x in centers_dict[key]])
-            lon_sum = sum([x[1] for x in centers_dict[key]])
-            return_list.append((lat_sum / length, lon_sum / length))
-    return return_list
-
-
-def __iteration_with_splitting(tuple_route_list, centers_list, split_count, iteration_count, print_logs=True):
+def __reservoir_sample(points, k, rng):
+    """Picks `k` random points out of an iterator in a single pass, holding only `k` points in memory"""
+    reservoir = np.empty((k, 2))
+    seen = 0
+    while True:
+        block = np.array(list(islice(points, DEFAULT_BATCH_SIZE)), dtype=np.float64).reshape(-1, 2)
+        if not len(block):
+            break
+        indexes = np.arange(seen, seen + len(block))
+        filling = indexes < k
+        reservoir[indexes[filling]] = block[filling]
+        # Algorithm R, the i-th point replaces a random slot with probability k / (i + 1)
+        slots = rng.integers(0, indexes[~filling] + 1) if (~filling).any() else indexes[:0]
+        replacing = slots < k
+        reservoir[slots[replacing]] = block[~filling][replacing]
+        seen += len(block)
+    return reservoir[:min(seen, k)]
+
+
+def __random_batches(points, batch_size, buffer_size, rng):
+    """Yields the points of an iterator as random batches, drawn from a buffer of `buffer_size` points
+
+    A batch is drawn without replacement and the points after it are moved into its slots, so every batch costs time in
+    proportion to `batch_size` and not to `buffer_size`
+    """
+    buffer = np.empty((max(buffer_size, batch_size) + batch_size, 2))
+    count = 0
+    exhausted = False
+    while not exhausted or count:
+        if not exhausted:
+            block = np.array(list(islice(points, max(batch_size, buffer_size - count))),
+                             dtype=np.float64).reshape(-1, 2)
+            exhausted = len(block) == 0
+            buffer[count:count + len(block)] = block
+            count += len(block)
+            if not count:
+                break
+        picks = rng.choice(count, size=min(batch_size, count), replace=False)
+        yield buffer[picks]
+        # The picked slots below the new end are filled with the points above it which weren't picked
+        count -= len(picks)
+        buffer[picks[picks < count]] = buffer[np.setdiff1d(np.arange(count, count + len(picks)), picks)]
+
+
+def normalize_by_sections(tuple_route_list, distance_between_points, iteration_count, split_count, print_logs=True,
+                          chunk_size=DEFAULT_CHUNK_SIZE, tolerance=0, distance_mode=DistanceModes.ELLIPSOIDAL.value,
+                          seed=None, workers=1):
+    """Finds evenly spread centers for the GPS points of a route by splitting every drive into ~1km sections and running
+    k-means on every section on its own
+
+    Parameters
+    ----------
+    tuple_route_list : List[List[(float, float)]]
+        The GPS points of every drive along the route, in driving order
+    distance_between_points : float
+        The wanted distance between two centers in km, sets the number of centers of every section
+    iteration_count : int
+        The maximal number of k-means iterations of every section
+    split_count : int
+        The maximal number of sections, the last one holds the rest of the route
+    print_logs : bool
+        Print logs while the function is running (the default is True)
+    chunk_size : int
+        The number of points whose distances to all the centers are computed at once (the default is 1024)
+    tolerance : float
+        Stop a section before `iteration_count` once no center moves more than this many meters in an iteration (the
+        default is 0, which always runs `iteration_count` iterations)
+    distance_mode : DistanceModes enum value
+        The distance formula used to assign points to centers (the default is ELLIPSOIDAL)
+    seed : int , optional
+        The seed of the initial centers choice, for repeatable results (the default is a random seed)
+    workers : int
+        The number of processes running sections at the same time, 1 runs them in the calling process (the default is
+        1)
+
+    Returns
+    -------
+    List[(float, float)]
+        The centers as latlong tuples, section after section, and in every section ordered by their distance from its
+        start
+
+    Notes
+    --------
+    A section has about 1km worth of points, so instead of a single problem of all the points against all the centers
+    there are many small ones, which are independent and run in parallel. Section `i` of every drive covers about the
+    same part of the route, so the sections are clustered across all the drives together.
+
+    See Also
+    -------
+    `split_tuple_list()` which splits a drive into sections
+    """
     all_sections = []
+    section_lengths = []
     for i in range(split_count):
         all_sections.append([])
+        section_lengths.append([])
     for route_list in tuple_route_list:
         temp = split_tuple_list(route_list, split_count)
-        for i in range(split_count):
+        for i in range(len(temp)):
             all_sections[i].extend(temp[i])
-    # create the initial center list
-    # do the iterations
-    # for each iteration run the algorithm for finding the sections' centers
+            section_lengths[i].append(consecutive_distances(temp[i]).sum() / 1000)
+    section_seeds = np.random.default_rng(seed).integers(0, 2 ** 32, size=split_count)
+    section_arguments = [(all_sections[i], max(1, int(round(np.mean(section_lengths[i]) / distance_between_points))),
+                          iteration_count, chunk_size, tolerance, distance_mode, section_seeds[i])
+                         for i in range(split_count) if all_sections[i]]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            section_centers = list(executor.map(__split_iteration, *zip(*section_arguments)))
+    else:
+        section_centers = [__split_iteration(*arguments) for arguments in section_arguments]
+    centers_list = []
+    for i in range(len(section_centers)):
+        if print_logs:
+            print('Section ' + str(i) + ' has ' + str(len(section_centers[i])) + ' centers')
+        centers_list.extend(section_centers[i])
+    return centers_list
 
 
 def split_tuple_list(tuple_list, split_count):
@@ -63,8 +390,9 @@ def split_tuple_list(tuple_list, split_count):
     current_position = 0
     current_split = 0
     sum1 = 0
+    step_lengths = consecutive_distances(tuple_list) / 1000
     for i in range(len(tuple_list) - 1):  # change to 2 if you want to include it
-        sum1 += distance.distance(tuple_list[i], tuple_list[i + 1]).km
+        sum1 += step_lengths[i]
         if sum1 > 1:
             sections_list.append(tuple_list[current_position:i + 1])  # change to 2 if you want to include it
             current_position = i
@@ -76,24 +404,23 @@ def split_tuple_list(tuple_list, split_count):
     return sections_list
 
 
-def __split_iteration(tuple_list, centers_list, print_logs=True):
-    centers_dict = {center: [] for center in centers_list}
-    length = len(tuple_list)
-    for i in range(length):
-        if print_logs:
-            print(length - i)
-        min_dist = distance.distance(tuple_list[i], centers_list[0])
-        current_center = centers_list[0]
-        for j in range(1, len(centers_list)):
-            if distance.distance(tuple_list[i], centers_list[j]) < min_dist:
-                min_dist = distance.distance(tuple_list[i], centers_list[j])
-                current_center = centers_list[j]
-        centers_dict[current_center].append(tuple_list[i])
-    return_list = []
-    for key in centers_dict:
-        length = len(centers_dict[key])
-        if length != 0:
-            lat_sum = sum([x[0]] for x in centers_dict[key])
-            lon_sum = sum([x[1]] for x in centers_dict[key])
-            return_list.append((lat_sum / length, lon_sum / length))
-    return return_list
+def __split_iteration(tuple_list, center_count, iteration_count, chunk_size, tolerance, distance_mode, seed):
+    """Runs k-means on the points of a single section
+
+    Returns
+    -------
+    List[(float, float)]
+        The centers of the section, ordered by their distance from the first point of the section
+    """
+    points = np.asarray(tuple_list, dtype=np.float64).reshape(-1, 2)
+    unique_points = np.unique(points, axis=0)
+    choice = np.random.default_rng(seed).choice(len(unique_points), min(center_count, len(unique_points)),
+                                                replace=False)
+    centers_list = [(lat, lon) for lat, lon in unique_points[np.sort(choice)].tolist()]
+    for i in range(iteration_count):
+        centers_list, max_movement = __iteration_with_all_points(points, centers_list, chunk_size=chunk_size,
+                                                                 distance_mode=distance_mode)
+        if max_movement < tolerance:
+            break
+    order = np.argsort(point_to_points(tuple_list[0], centers_list), kind='stable')
+    return [centers_list[i] for i in order]
@@ -0,0 +1,521 @@
+import os
+import struct
+from enum import Enum
+from heapq import heapify
+from heapq import heappop
+from heapq import heappush
+from numbers import Integral
+
+import numpy as np
+
+from csv_util import load_driving_model_columns
+from geodesic import paired_distances
+from spatial_index import CentersIndex
+
+START_ID = 0  # The synthetic vertex every drive starts from
+END_ID = 1  # The synthetic vertex every drive ends in
+START_VERTEX = (-200, -200, 0)
+END_VERTEX = (200, 200, 0)
+
+HEURISTIC_SCALE = 1 - 1e-9  # Keeps the heuristic a lower bound despite rounding errors in the distances
+
+GRAPH_FILE_MAGIC = b'ECOGRAPH'
+GRAPH_FILE_VERSION = 1
+GRAPH_FILE_HEADER = struct.Struct('<8sIQQ')  # Magic, format version, vertex count, edge count
+GRAPH_FILE_HEADER_SIZE = 64  # The header is padded so the arrays after it start aligned
+# The arrays of a graph file, in file order, with their little endian types and their length by the vertex count v and
+# the edge count e
+GRAPH_FILE_ARRAYS = (('lats', '<f8', lambda v, e: v), ('lons', '<f8', lambda v, e: v),
+                     ('speeds', '<i8', lambda v, e: v), ('offsets', '<i8', lambda v, e: v + 1),
+                     ('neighbors', '<i8', lambda v, e: e), ('cost_sums', '<f8', lambda v, e: e),
+                     ('counts', '<i8', lambda v, e: e), ('costs', '<f8', lambda v, e: e))
+
+
+class SearchModes(Enum):
+    DIJKSTRA = 1  # Finds the cheapest path from the source to every vertex
+    A_STAR = 2  # Finds the cheapest path from the source to a single target, guided by a fuel cost lower bound
+
+
+class EcoRouteGraph:
+    """The driving models graph in compressed sparse row (CSR) form
+
+    Vertexes are integer ids into the `lats`, `lons` and `speeds` arrays, ids 0 and 1 are the synthetic start and end
+    vertexes. The edges leaving vertex `v` are `neighbors[offsets[v]:offsets[v + 1]]`, with their average costs in the
+    same positions of `costs`, and the cost sums and drive counts they were averaged from in `cost_sums` and `counts`.
+
+    Like `vertex.VertexFactory`, the graph is built in reverse, if in the real world a drive went from a to b, the graph
+    has an edge from b to a.
+
+    Parameters
+    ----------
+    lats : numpy.ndarray
+        The latitude of every vertex
+    lons : numpy.ndarray
+        The longitude of every vertex
+    speeds : numpy.ndarray
+        The speed of every vertex
+    offsets : numpy.ndarray
+        The CSR offsets, of length vertex count + 1
+    neighbors : numpy.ndarray
+        The target of every edge
+    cost_sums : numpy.ndarray
+        The sum of the costs of every edge over all the drives which passed it
+    counts : numpy.ndarray
+        The number of drives which passed every edge
+    costs : numpy.ndarray, optional
+        The average cost of every edge, if it was already computed (the default is computing it from `cost_sums` and
+        `counts`)
+    """
+
+    def __init__(self, lats, lons, speeds, offsets, neighbors, cost_sums, counts, costs=None):
+        self.lats = lats
+        self.lons = lons
+        self.speeds = speeds
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.cost_sums = cost_sums
+        self.counts = counts
+        self.costs = cost_sums / np.maximum(counts, 1) if costs is None else costs
+        self.version = 0  # Set by whoever keeps the graph up to date, see `graph_store.EcoRouteGraphStore`
+        self.__lower_bounds = {}
+
+    def vertex_count(self):
+        return len(self.lats)
+
+    def edge_count(self):
+        return len(self.neighbors)
+
+    def get_vertex(self, vertex_id):
+        return self.lats[vertex_id].item(), self.lons[vertex_id].item(), self.speeds[vertex_id].item()
+
+    def find_cheapest_paths(self, source=END_ID):
+        """Dijkstra's algorithm with a binary heap from `source`
+
+        Parameters
+        ----------
+        source : Union[int, List[int]]
+            The vertex id to search from, or several vertex ids to search from all of them at once (the default is the
+            end vertex, which gives the cheapest path to the end from every vertex, since the graph is reversed)
+
+        Returns
+        ----------
+        (numpy.ndarray, numpy.ndarray)
+            The cost of the cheapest path from `source` to every vertex, inf where there is none, and the vertex before
+            every vertex on that path, -1 for `source` and unreachable vertexes
+        """
+        offsets = self.offsets.tolist()
+        neighbors = self.neighbors.tolist()
+        costs = self.costs.tolist()
+        cost_to = [float('inf')] * self.vertex_count()
+        parents = [-1] * self.vertex_count()
+        visited = bytearray(self.vertex_count())
+        sources = [int(source)] if isinstance(source, Integral) else [int(vertex_id) for vertex_id in source]
+        for vertex_id in sources:
+            cost_to[vertex_id] = 0.0
+        heap = [(0.0, vertex_id) for vertex_id in sources]
+        heapify(heap)
+        while heap:
+            current_cost, current = heappop(heap)
+            if visited[current]:
+                continue
+            visited[current] = 1
+            for i in range(offsets[current], offsets[current + 1]):
+                neighbor = neighbors[i]
+                if not visited[neighbor] and current_cost + costs[i] < cost_to[neighbor]:
+                    cost_to[neighbor] = current_cost + costs[i]
+                    parents[neighbor] = current
+                    heappush(heap, (cost_to[neighbor], neighbor))
+        return np.array(cost_to), np.array(parents, dtype=np.int64)
+
+    def find_cheapest_path_a_star(self, source=END_ID, target=START_ID):
+        """A* search from `source` to `target`, with `fuel_cost_lower_bounds()` as its heuristic
+
+        Parameters
+        ----------
+        source : int
+            The vertex id to search from (the default is the end vertex)
+        target : int
+            The vertex id to search for (the default is the start vertex)
+
+        Returns
+        ----------
+        (numpy.ndarray, numpy.ndarray, int)
+            The costs and parents like `find_cheapest_paths()` returns them, but only final for the vertexes on the
+            cheapest path to `target`, which `cheapest_route()` walks, and the number of vertexes which were expanded
+        """
+        offsets = self.offsets.tolist()
+        neighbors = self.neighbors.tolist()
+        costs = self.costs.tolist()
+        lower_bounds = self.fuel_cost_lower_bounds(target).tolist()
+        cost_to = [float('inf')] * self.vertex_count()
+        parents = [-1] * self.vertex_count()
+        visited = bytearray(self.vertex_count())
+        expanded_count = 0
+        cost_to[source] = 0.0
+        heap = [(lower_bounds[source], source)]
+        while heap:
+            current = heappop(heap)[1]
+            if visited[current]:
+                continue
+            visited[current] = 1
+            expanded_count += 1
+            if current == target:
+                break
+            current_cost = cost_to[current]
+            for i in range(offsets[current], offsets[current + 1]):
+                neighbor = neighbors[i]
+                if not visited[neighbor] and current_cost + costs[i] < cost_to[neighbor]:
+                    cost_to[neighbor] = current_cost + costs[i]
+                    parents[neighbor] = current
+                    heappush(heap, (cost_to[neighbor] + lower_bounds[neighbor], neighbor))
+        return np.array(cost_to), np.array(parents, dtype=np.int64), expanded_count
+
+    def fuel_cost_lower_bounds(self, target=START_ID):
+        """A lower bound on the cost of the cheapest path from every vertex to `target`, computed once per target
+
+        The bound is the geodesic distance left times the lowest cost per meter of all the edges between real vertexes.
+        Every edge costs at least that rate times its length, and by the triangle inequality a path is never shorter
+        than the distance between its ends, so the bound is admissible and consistent. The synthetic vertexes have no
+        real position, paths reach the synthetic start vertex from the first vertex of any drive at no cost, so the
+        distance left to it is the distance to the closest such vertex. The bound of the synthetic vertexes is 0.
+
+        Parameters
+        ----------
+        target : int
+            The vertex id to bound the costs to (the default is the start vertex)
+
+        Returns
+        ----------
+        numpy.ndarray
+            The bound of every vertex
+        """
+        if target in self.__lower_bounds:
+            return self.__lower_bounds[target]
+        sources = np.repeat(np.arange(self.vertex_count()), np.diff(self.offsets))
+        if target in (START_ID, END_ID):
+            anchors = np.unique(sources[self.neighbors == target])
+        else:
+            anchors = np.array([target])
+        anchors = anchors[anchors > END_ID]
+        lower_bounds = np.zeros(self.vertex_count())
+        real = (sources > END_ID) & (self.neighbors > END_ID)
+        lengths = paired_distances(np.column_stack((self.lats[sources[real]], self.lons[sources[real]])),
+                                   np.column_stack((self.lats[self.neighbors[real]], self.lons[self.neighbors[real]])))
+        moving = lengths > 0
+        if len(anchors) and moving.any():
+            cost_per_meter = max(np.min(self.costs[real][moving] / lengths[moving]), 0)
+            if cost_per_meter > 0:
+                points = np.column_stack((self.lats[2:], self.lons[2:]))
+                distances = CentersIndex(np.column_stack((self.lats[anchors], self.lons[anchors]))).query(points)[1]
+                lower_bounds[2:] = distances * cost_per_meter * HEURISTIC_SCALE
+        self.__lower_bounds[target] = lower_bounds
+        return lower_bounds
+
+    def cheapest_route(self, cost_to, parents, start=START_ID, end=END_ID):
+        """Walks the parents of a search from `end` back from `start`
+
+        Parameters
+        ----------
+        cost_to : numpy.ndarray
+            The costs found by `find_cheapest_paths()`
+        parents : numpy.ndarray
+            The parents found by `find_cheapest_paths()`
+        start : int
+            The vertex id the route starts from (the default is the start vertex)
+        end : int
+            The vertex id the search ran from (the default is the end vertex)
+
+        Returns
+        ----------
+        List[List[Union[float, int]]]
+            A driving model of the route, without the synthetic vertexes, from its last vertex to its first, whose
+            costs are the costs of the edges between the vertexes
+        """
+        route = []
+        current = start
+        while True:
+            current = parents[current].item()
+            if current == -1:
+                raise ValueError('There is no route from vertex ' + str(start) + ' to vertex ' + str(end))
+            lat, lon, speed = self.get_vertex(current)
+            route.append([lat, lon, speed, cost_to[current].item()])
+            if parents[current] == end:
+                break
+        route = list(reversed(route))
+        for i in range(len(route) - 1):
+            route[i][3] = route[i + 1][3] - route[i][3]
+        route[-1][3] = 0
+        return route
+
+
+def build_graph(drive_models):
+    """Builds the graph of a list of driving models in bulk
+
+    Parameters
+    ----------
+    drive_models : List[List[List[Union[float, int]]]]
+        Driving models, as loaded by `csv_util.load_driving_model_file()`
+
+    Returns
+    ----------
+    EcoRouteGraph
+        The graph, with the same vertexes and average edge costs as `vertex.VertexFactory` builds
+    """
+    keys = [START_VERTEX, END_VERTEX]
+    edge_sources = []
+    edge_targets = []
+    edge_costs = []
+    for drive_model in drive_models:
+        model_keys, model_sources, model_targets, model_costs = drive_model_edges(drive_model)
+        # Local key indexes are offset by the keys gathered so far, the synthetic vertexes are the first two keys
+        edge_sources.extend(source if source < 2 else source + len(keys) - 2 for source in model_sources)
+        edge_targets.extend(target if target < 2 else target + len(keys) - 2 for target in model_targets)
+        edge_costs.extend(model_costs)
+        keys.extend(model_keys[2:])
+    return __graph_from_keys(np.array(keys, dtype=np.float64).reshape(-1, 3), np.array(edge_sources, dtype=np.int64),
+                             np.array(edge_targets, dtype=np.int64), np.array(edge_costs, dtype=np.float64))
+
+
+def build_graph_from_columns(drive_model_columns):
+    """Builds the graph of a list of driving models in bulk, the same graph `build_graph()` builds from their rows
+
+    Parameters
+    ----------
+    drive_model_columns : List[(numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray)]
+        Driving models, as loaded by `csv_util.load_driving_model_columns()`
+
+    Returns
+    ----------
+    EcoRouteGraph
+        The graph
+    """
+    keys = [np.array([START_VERTEX, END_VERTEX], dtype=np.float64)]
+    edge_sources = []
+    edge_targets = []
+    edge_costs = []
+    key_count = 2
+    for lats, lons, speeds, costs in drive_model_columns:
+        # The keys and edges of drive_model_edges(), in the same order, with the key indexes offset by key_count
+        row_count = len(lats)
+        keys.append(np.array([(lats[0], lons[0], speeds[0])], dtype=np.float64))
+        keys.append(np.column_stack((lats, lons, speeds // 5 * 5)).astype(np.float64))
+        keys.append(np.array([(lats[-1], lons[-1], speeds[-1])], dtype=np.float64))
+        steps = np.arange(row_count - 1, 0, -1)
+        edge_sources.append(np.concatenate(([key_count], key_count + 1 + steps, [END_ID])))
+        edge_targets.append(np.concatenate(([START_ID], key_count + steps, [key_count + row_count + 1])))
+        edge_costs.append(np.concatenate(([0], costs[steps - 1], [0])))
+        key_count += row_count + 2
+    return __graph_from_keys(np.concatenate(keys), np.concatenate(edge_sources).astype(np.int64),
+                             np.concatenate(edge_targets).astype(np.int64),
+                             np.concatenate(edge_costs).astype(np.float64))
+
+
+def __graph_from_keys(keys, edge_sources, edge_targets, edge_costs):
+    """Merges the equal vertex keys and repeated edges of driving models, whose first two keys are the synthetic start
+    and end vertexes, into a graph"""
+    # Equal keys are the same vertex, the synthetic vertexes keep ids 0 and 1 and the rest are sorted
+    unique_keys, key_ids = np.unique(keys[2:], axis=0, return_inverse=True)
+    key_ids = np.concatenate(([START_ID, END_ID], key_ids.ravel() + 2))
+    lats = np.concatenate(([START_VERTEX[0], END_VERTEX[0]], unique_keys[:, 0]))
+    lons = np.concatenate(([START_VERTEX[1], END_VERTEX[1]], unique_keys[:, 1]))
+    speeds = np.concatenate(([START_VERTEX[2], END_VERTEX[2]], unique_keys[:, 2])).astype(np.int64)
+    vertex_count = len(lats)
+    edge_keys = key_ids[edge_sources] * vertex_count + key_ids[edge_targets]
+    # Repeated edges are merged, their costs are added in the order they were read
+    unique_edge_keys, edge_ids = np.unique(edge_keys, return_inverse=True)
+    cost_sums = np.bincount(edge_ids.ravel(), weights=edge_costs, minlength=len(unique_edge_keys))
+    counts = np.bincount(edge_ids.ravel(), minlength=len(unique_edge_keys))
+    return graph_from_edges(lats, lons, speeds, unique_edge_keys // vertex_count, unique_edge_keys % vertex_count,
+                            cost_sums, counts)
+
+
+def graph_from_edges(lats, lons, speeds, sources, targets, cost_sums, counts, costs=None):
+    """Builds the graph of a list of merged edges, each edge appearing once
+
+    Parameters
+    ----------
+    lats, lons, speeds : numpy.ndarray
+        The coordinates and speed of every vertex
+    sources, targets : numpy.ndarray
+        The vertex ids at both ends of every edge
+    cost_sums, counts : numpy.ndarray
+        The cost sum and drive count of every edge
+    costs : numpy.ndarray, optional
+        The average cost of every edge (the default is computing it from `cost_sums` and `counts`)
+
+    Returns
+    ----------
+    EcoRouteGraph
+        The graph
+    """
+    order = np.argsort(sources, kind='stable')
+    offsets = np.zeros(len(lats) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=len(lats)), out=offsets[1:])
+    return EcoRouteGraph(lats, lons, speeds, offsets, targets[order], cost_sums[order], counts[order],
+                         None if costs is None else costs[order])
+
+
+def load_graph_from_dir(dir_path):
+    """Builds the graph of all the driving model files in a directory
+
+    Parameters
+    ----------
+    dir_path : str
+        The directory of the driving model files
+
+    Returns
+    ----------
+    EcoRouteGraph
+        The graph
+    """
+    return build_graph_from_columns(load_driving_model_columns(os.path.join(dir_path, filename))
+                                    for filename in os.listdir(dir_path))
+
+
+def save_graph_file(graph, output_path):
+    """Saves a graph to a binary graph file, which `load_graph_file()` maps back without parsing
+
+    The file is a 64 bytes header, with the magic `GRAPH_FILE_MAGIC`, the format version and the vertex and edge counts,
+    followed by the arrays of `GRAPH_FILE_ARRAYS` back to back
+
+    Parameters
+    ----------
+    graph : EcoRouteGraph
+        The graph
+    output_path : str
+        The path of the graph file
+    """
+    vertex_count = graph.vertex_count()
+    edge_count = graph.edge_count()
+    with open(output_path, 'wb') as file:
+        file.write(GRAPH_FILE_HEADER.pack(GRAPH_FILE_MAGIC, GRAPH_FILE_VERSION, vertex_count, edge_count)
+                   .ljust(GRAPH_FILE_HEADER_SIZE, b'\0'))
+        for name, dtype, length in GRAPH_FILE_ARRAYS:
+            array = np.ascontiguousarray(getattr(graph, name), dtype=dtype)
+            if len(array) != length(vertex_count, edge_count):
+                raise ValueError('The graph ' + name + ' array has ' + str(len(array)) + ' values instead of ' +
+                                 str(length(vertex_count, edge_count)))
+            file.write(array.tobytes())
+
+
+def load_graph_file(input_path):
+    """Maps a binary graph file saved by `save_graph_file()` into memory
+
+    Parameters
+    ----------
+    input_path : str
+        The path of the graph file
+
+    Returns
+    ----------
+    EcoRouteGraph
+        The graph, whose arrays are read only views of the mapped file, pages are read from the disk only once used
+    """
+    with open(input_path, 'rb') as file:
+        header = file.read(GRAPH_FILE_HEADER.size)
+    if len(header) < GRAPH_FILE_HEADER.size:
+        raise ValueError(input_path + ' is not a graph file')
+    magic, version, vertex_count, edge_count = GRAPH_FILE_HEADER.unpack(header)
+    if magic != GRAPH_FILE_MAGIC:
+        raise ValueError(input_path + ' is not a graph file')
+    if version != GRAPH_FILE_VERSION:
+        raise ValueError(input_path + ' has graph file version ' + str(version) + ', only version ' +
+                         str(GRAPH_FILE_VERSION) + ' is supported')
+    mapped = np.memmap(input_path, dtype=np.uint8, mode='r')
+    arrays = {}
+    offset = GRAPH_FILE_HEADER_SIZE
+    for name, dtype, length in GRAPH_FILE_ARRAYS:
+        count = length(vertex_count, edge_count)
+        if offset + count * np.dtype(dtype).itemsize > len(mapped):
+            raise ValueError(input_path + ' is truncated')
+        arrays[name] = np.frombuffer(mapped, dtype=dtype, count=count, offset=offset)
+        offset += count * np.dtype(dtype).itemsize
+    return EcoRouteGraph(**arrays)
+
+
+def is_graph_file(path):
+    """Whether a path is a binary graph file, by its magic
+
+    Parameters
+    ----------
+    path : str
+        The path
+
+    Returns
+    ----------
+    bool
+        Whether it's a graph file
+    """
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as file:
+        return file.read(len(GRAPH_FILE_MAGIC)) == GRAPH_FILE_MAGIC
+
+
+def graph_from_vertex_factory(vertex_factory):
+    """Converts the graph of a `vertex.VertexFactory` to an `EcoRouteGraph`, so it can be saved with `save_graph_file()`
+
+    Parameters
+    ----------
+    vertex_factory : vertex.VertexFactory
+        The factory, before or after `calculate_edge_costs()` was called on it. After it, only the averages are left,
+        and every edge is taken to be driven once
+
+    Returns
+    ----------
+    EcoRouteGraph
+        The graph, the start and end vertexes are ids 0 and 1 and the rest are numbered in the factory's order
+    """
+    vertexes = [vertex_factory.get_start(), vertex_factory.get_end()]
+    vertexes.extend(vertex for key, vertex in vertex_factory.vertex_dict.items() if key not in ('start', 'end'))
+    vertex_ids = {id(vertex): i for i, vertex in enumerate(vertexes)}
+    sources = []
+    targets = []
+    cost_sums = []
+    counts = []
+    for i, vertex in enumerate(vertexes):
+        for neighbor, edge in vertex.neighbors.items():
+            sources.append(i)
+            targets.append(vertex_ids[id(neighbor)])
+            if isinstance(edge, list):
+                counts.append(edge[0])
+                cost_sums.append(edge[1])
+            else:
+                counts.append(1)
+                cost_sums.append(edge)
+    return graph_from_edges(np.array([vertex.lat for vertex in vertexes], dtype=np.float64),
+                            np.array([vertex.lon for vertex in vertexes], dtype=np.float64),
+                            np.array([vertex.speed for vertex in vertexes], dtype=np.int64),
+                            np.array(sources, dtype=np.int64), np.array(targets, dtype=np.int64),
+                            np.array(cost_sums, dtype=np.float64), np.array(counts, dtype=np.int64))
+
+
+def drive_model_edges(drive_model):
+    """The vertexes and edges a single driving model adds to the graph, the same ones and in the same order as
+    `vertex.VertexFactory` gets them
+
+    Parameters
+    ----------
+    drive_model : List[List[Union[float, int]]]
+        A driving model, as loaded by `csv_util.load_driving_model_file()`
+
+    Returns
+    ----------
+    (List[(float, float, int)], List[int], List[int], List[float])
+        The vertex keys, whose first two are the synthetic start and end vertexes, and the source key index, target key
+        index and cost of every edge. A key may repeat, it's the same vertex
+    """
+    keys = [START_VERTEX, END_VERTEX, (drive_model[0][0], drive_model[0][1], drive_model[0][2])]
+    keys.extend((row[0], row[1], row[2] // 5 * 5) for row in drive_model)
+    keys.append((drive_model[-1][0], drive_model[-1][1], drive_model[-1][2]))
+    sources = [2]
+    targets = [START_ID]
+    costs = [0]
+    for i in range(len(drive_model) - 1, 0, -1):
+        sources.append(3 + i)
+        targets.append(2 + i)
+        costs.append(drive_model[i - 1][-1])
+    sources.append(END_ID)
+    targets.append(len(keys) - 1)
+    costs.append(0)
+    return keys, sources, targets, costs
@@ -0,0 +1,213 @@
+import csv
+import os
+
+import numpy as np
+
+from csv_util import load_driving_model_file
+from graph import END_VERTEX
+from graph import START_VERTEX
+from graph import drive_model_edges
+from graph import graph_from_edges
+from util import file_content_hash
+
+GRAPH_FILE_NAME = 'graph.npz'
+INGESTED_FILE_NAME = 'ingested.csv'  # Where saves before the ingested files were in the graph file kept them
+
+
+class EcoRouteGraphStore:
+    """A graph of driving models which new models are added to, saved to and loaded from a directory
+
+    The store keeps the raw cost sum and drive count of every edge, the same data `vertex.Vertex.add_neighbor()`
+    accumulates, so adding a driving model only updates the vertexes and edges it passes, and recomputes the average
+    cost of those edges alone. Every added file is recorded by the SHA-256 hash of its content, adding the same content
+    again, under any name, does nothing. A file whose path, size and modification time were seen before isn't even
+    read again.
+
+    Parameters
+    ----------
+    store_dir_path : str
+        The directory the store is saved in, it's loaded from there if it was saved before
+
+    Attributes
+    ----------
+    version : int
+        Grows by one with every added driving model, so anything computed from `get_graph()` can tell if it's stale
+    """
+
+    def __init__(self, store_dir_path):
+        self.store_dir_path = store_dir_path
+        self.version = 0
+        self.lats = [START_VERTEX[0], END_VERTEX[0]]
+        self.lons = [START_VERTEX[1], END_VERTEX[1]]
+        self.speeds = [START_VERTEX[2], END_VERTEX[2]]
+        self.vertex_ids = {START_VERTEX: 0, END_VERTEX: 1}
+        self.sources = []
+        self.targets = []
+        self.cost_sums = []
+        self.counts = []
+        self.costs = []
+        self.edge_ids = {}
+        self.ingested = {}  # Content hash to the name of the file it was first read from
+        self.seen_files = {}  # (absolute path, size, modification time) to the content hash of a file that was added
+        self.__graph = None
+        if os.path.isfile(os.path.join(store_dir_path, GRAPH_FILE_NAME)):
+            self.__load()
+
+    def vertex_count(self):
+        return len(self.lats)
+
+    def edge_count(self):
+        return len(self.sources)
+
+    def add_driving_model_file(self, file_path):
+        """Adds a driving model file to the graph, unless a file with the same content was already added
+
+        Parameters
+        ----------
+        file_path : str
+            The driving model file
+
+        Returns
+        ----------
+        bool
+            Whether the file was added
+        """
+        stat = os.stat(file_path)
+        stat_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        if stat_key in self.seen_files:
+            return False
+        content_hash = file_content_hash(file_path)
+        if content_hash not in self.ingested:
+            self.add_driving_model(load_driving_model_file(file_path))
+            self.ingested[content_hash] = os.path.basename(file_path)
+            added = True
+        else:
+            added = False
+        self.seen_files[stat_key] = content_hash
+        return added
+
+    def add_driving_model(self, drive_model):
+        """Adds a driving model to the graph, without recording it as an ingested file
+
+        Parameters
+        ----------
+        drive_model : List[List[Union[float, int]]]
+            A driving model, as loaded by `csv_util.load_driving_model_file()`
+        """
+        keys, sources, targets, costs = drive_model_edges(drive_model)
+        key_ids = [self.__vertex_id(key) for key in keys]
+        for source, target, cost in zip(sources, targets, costs):
+            edge = (key_ids[source], key_ids[target])
+            edge_id = self.edge_ids.get(edge)
+            if edge_id is None:
+                self.edge_ids[edge] = len(self.sources)
+                self.sources.append(edge[0])
+                self.targets.append(edge[1])
+                self.cost_sums.append(cost)
+                self.counts.append(1)
+                self.costs.append(cost)
+            else:
+                self.cost_sums[edge_id] += cost
+                self.counts[edge_id] += 1
+                self.costs[edge_id] = self.cost_sums[edge_id] / self.counts[edge_id]
+        self.version += 1
+        self.__graph = None
+
+    def add_dir(self, dir_path, print_logs=False):
+        """Adds every driving model file in a directory which wasn't added before
+
+        Parameters
+        ----------
+        dir_path : str
+            The directory of the driving model files
+        print_logs : bool, optional
+            Whether to print every added file (the default is False)
+
+        Returns
+        ----------
+        List[str]
+            The names of the files which were added
+        """
+        added = []
+        for filename in os.listdir(dir_path):
+            if self.add_driving_model_file(os.path.join(dir_path, filename)):
+                added.append(filename)
+                if print_logs:
+                    print('Added ' + filename)
+        return added
+
+    def get_graph(self):
+        """The graph in compressed sparse row form, it's rebuilt only after models were added
+
+        Returns
+        ----------
+        graph.EcoRouteGraph
+            The graph
+        """
+        if self.__graph is None:
+            self.__graph = graph_from_edges(np.array(self.lats, dtype=np.float64),
+                                            np.array(self.lons, dtype=np.float64),
+                                            np.array(self.speeds, dtype=np.int64),
+                                            np.array(self.sources, dtype=np.int64),
+                                            np.array(self.targets, dtype=np.int64),
+                                            np.array(self.cost_sums, dtype=np.float64),
+                                            np.array(self.counts, dtype=np.int64),
+                                            np.array(self.costs, dtype=np.float64))
+            self.__graph.version = self.version
+        return self.__graph
+
+    def save(self):
+        """Saves the store to its directory, the graph and the ingested files are a single file which replaces the one
+        of the previous save only once it's written, so they can't get out of sync
+        """
+        os.makedirs(self.store_dir_path, exist_ok=True)
+        graph_path = os.path.join(self.store_dir_path, GRAPH_FILE_NAME)
+        seen_files = list(self.seen_files.items())
+        with open(graph_path + '.tmp', 'wb') as file:
+            np.savez(file, version=self.version, lats=np.array(self.lats, dtype=np.float64),
+                     lons=np.array(self.lons, dtype=np.float64), speeds=np.array(self.speeds, dtype=np.int64),
+                     sources=np.array(self.sources, dtype=np.int64), targets=np.array(self.targets, dtype=np.int64),
+                     cost_sums=np.array(self.cost_sums, dtype=np.float64),
+                     counts=np.array(self.counts, dtype=np.int64),
+                     ingested_hashes=np.array(list(self.ingested.keys()), dtype=str),
+                     ingested_names=np.array(list(self.ingested.values()), dtype=str),
+                     seen_paths=np.array([key[0] for key, _ in seen_files], dtype=str),
+                     seen_sizes=np.array([key[1] for key, _ in seen_files], dtype=np.int64),
+                     seen_mtimes=np.array([key[2] for key, _ in seen_files], dtype=np.int64),
+                     seen_hashes=np.array([content_hash for _, content_hash in seen_files], dtype=str))
+        os.replace(graph_path + '.tmp', graph_path)
+        # The ingested files of older saves were kept next to the graph
+        ingested_path = os.path.join(self.store_dir_path, INGESTED_FILE_NAME)
+        if os.path.isfile(ingested_path):
+            os.remove(ingested_path)
+
+    def __load(self):
+        with np.load(os.path.join(self.store_dir_path, GRAPH_FILE_NAME)) as data:
+            self.version = data['version'].item()
+            self.lats = data['lats'].tolist()
+            self.lons = data['lons'].tolist()
+            self.speeds = data['speeds'].tolist()
+            self.sources = data['sources'].tolist()
+            self.targets = data['targets'].tolist()
+            self.cost_sums = data['cost_sums'].tolist()
+            self.counts = data['counts'].tolist()
+            if 'ingested_hashes' in data.files:
+                self.ingested = dict(zip(data['ingested_hashes'].tolist(), data['ingested_names'].tolist()))
+                self.seen_files = dict(zip(zip(data['seen_paths'].tolist(), data['seen_sizes'].tolist(),
+                                               data['seen_mtimes'].tolist()), data['seen_hashes'].tolist()))
+        self.costs = [cost_sum / count for cost_sum, count in zip(self.cost_sums, self.counts)]
+        self.vertex_ids = {key: i for i, key in enumerate(zip(self.lats, self.lons, self.speeds))}
+        self.edge_ids = {edge: i for i, edge in enumerate(zip(self.sources, self.targets))}
+        ingested_path = os.path.join(self.store_dir_path, INGESTED_FILE_NAME)
+        if not self.ingested and os.path.isfile(ingested_path):
+            with open(ingested_path, newline='') as file:
+                self.ingested = {row[0]: row[1] for row in csv.reader(file) if row}
+
+    def __vertex_id(self, key):
+        vertex_id = self.vertex_ids.get(key)
+        if vertex_id is None:
+            vertex_id = self.vertex_ids[key] = len(self.lats)
+            self.lats.append(key[0])
+            self.lons.append(key[1])
+            self.speeds.append(key[2])
+        return vertex_id
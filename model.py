@@ -1,39 +1,45 @@
 import csv
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-from geopy import distance
+import numpy as np
 
-from csv_util import load_drive_file
-from csv_util import load_driving_model_file
-from util import calculate_cost
-from util import find_closest_center
-from vertex import VertexFactory
+from csv_util import load_drive_columns
+from graph import END_ID
+from graph import START_ID
+from graph import SearchModes
+from graph import is_graph_file
+from graph import load_graph_file
+from graph import load_graph_from_dir
+from graph_store import EcoRouteGraphStore
+from spatial_index import CentersIndex
+from util import calculate_segment_costs
 
 
-def generate_drive_model(file_path, centers_list, model_save_path=None):
+def generate_drive_model(file_path, centers_list, model_save_path=None, centers_index=None, drive_cache=None):
     """
     See Also
     ----------
     `csv_util.load_tuples_csv_file()` to load the tuple list.
+
+    `spatial_index.CentersIndex` to build `centers_index` once for many drives, it is built from `centers_list` if
+    not given.
+
+    `drive_cache.DriveCache` to keep the parsed drive and the closest center of every row between runs, as
+    `drive_cache`.
     """
-    matrix = __generate_matrix_for_processing(file_path, centers_list)
-    found_first = False
-    last_model = []
-    sum1 = 0
-    current = 0
-    for i in range(len(matrix) - 1):
-        if found_first:
-            sum1 += calculate_cost(matrix[i][0], matrix[i - 1][0], matrix[i][4], matrix[i - 1][4])
-            if matrix[i][-1]:
-                last_model.append(
-                    [matrix[i][5], matrix[i][6], matrix[i][3] // 5 * 5, 0])  # changed which latlon we take
-                last_model[current][3] = sum1
-                sum1 = 0
-                current += 1
-        else:
-            if matrix[i][-1]:
-                last_model.append([matrix[i][5], matrix[i][6], matrix[i][3] // 5 * 5, 0])
-                found_first = True
+    times, speeds, fcrs, center_indexes, flagged_rows = __generate_columns_for_processing(file_path, centers_list,
+                                                                                          centers_index, drive_cache)
+    # The last row never starts or ends a segment
+    flagged_rows = flagged_rows[flagged_rows < len(times) - 1]
+    segment_costs = calculate_segment_costs(times, fcrs)
+    last_model = [[centers_list[center_index][0], centers_list[center_index][1], speed // 5 * 5, 0] for
+                  center_index, speed in zip(center_indexes[flagged_rows].tolist(), speeds[flagged_rows].tolist())]
+    for i in range(len(flagged_rows) - 1):
+        # The costs are added one by one in the order the rows were read, a cumulative sum over the whole drive would
+        # differ from that in the last bits
+        last_model[i][3] = np.cumsum(segment_costs[flagged_rows[i]:flagged_rows[i + 1]])[-1].item()
     if model_save_path:
         with open(model_save_path, "w+", newline='') as f:
             writer = csv.writer(f)
@@ -41,78 +47,152 @@ def generate_drive_model(file_path, centers_list, model_save_path=None):
     return last_model
 
 
-def __generate_matrix_for_processing(file_path, centers_list):
-    matrix = [[int(row[0]), float(row[1]), float(row[2]), int(row[3]), float(row[-1]), None, None, False] for row in
-              load_drive_file(file_path)]
-    shortest_dist_dict = {x: -1 for x in centers_list}
-    checked_dict = {x: False for x in centers_list}
-    for row in matrix:
-        row[5], row[6] = find_closest_center(row[1], row[2], centers_list)
-        if shortest_dist_dict[(row[5], row[6])] == -1 or \
-                distance.distance((row[1], row[2]), (row[5], row[6])) < shortest_dist_dict[(row[5], row[6])]:
-            shortest_dist_dict[(row[5], row[6])] = distance.distance((row[1], row[2]), (row[5], row[6]))
-    for row in matrix:
-        if distance.distance((row[1], row[2]), (row[5], row[6])) == shortest_dist_dict[(row[5], row[6])] and \
-                not checked_dict[(row[5], row[6])]:
-            row[-1] = True
-            checked_dict[(row[5], row[6])] = True
-    return matrix
-
-
-def cheapest_path_model(dir_path):  # change name to find cheapest path
-    vertex_factory = VertexFactory()
-    for filename in os.listdir(dir_path):
-        __load_driving_model_file(os.path.join(dir_path, filename), vertex_factory)
-    vertex_factory.calculate_edge_costs()
-
-    # test printing, need to keep going
-    # for v in vertex_factory.get_all_vertexes():
-    #     if len(v.neighbors) > 3:
-    #         print(v)
-    #         v.print_neighbors()
-    # TODO still needs to calculate the cheapest route
-    visited_vertexes = []
-    found_vertexes = [vertex_factory.get_end()]
-    while found_vertexes:
-        current_vertex = min(found_vertexes, key=lambda x: x.cost_to)
-        visited_vertexes.append(current_vertex)
-        found_vertexes.remove(current_vertex)
-        for neighbor in current_vertex.get_neighbors():
-            if neighbor not in visited_vertexes and neighbor not in found_vertexes:
-                found_vertexes.append(neighbor)
-        current_vertex.update_neighbors()
-
-    # test section - still needs to return the model
-    curr = vertex_factory.get_start()
-    return_model = []
-    while True:
-        curr = vertex_factory.get_vertex_by_id(curr.father_id)
-        return_model.append([curr.lat, curr.lon, curr.speed, curr.cost_to])
-        if curr.father_id == '200,200,0':
-            break
-    return_model = list(reversed(return_model))
-
-    for i in range(len(return_model) - 1):
-        return_model[i][3] = return_model[i + 1][3] - return_model[i][3]
-    return_model[-1][3] = 0
+def generate_dir_drive_models(input_dir_path, centers_list, output_dir_path, create=True, print_logs=True, workers=1,
+                              centers_index=None, drive_cache=None):
+    """Generates the driving model of every drive file in a directory and saves it under the same file name
+
+    Parameters
+    ----------
+    input_dir_path : str
+        The path of the directory which holds the drive files
+    centers_list : List[(float, float)]
+        The latlong tuples of the centers
+    output_dir_path : str
+        The path for the output directory
+    create : bool
+        Create the output directory if it does not exist (the default is True)
+    print_logs : bool
+        Print the time of every drive and the throughput of the whole directory (the default is True)
+    workers : int
+        The number of processes generating models at the same time, 1 generates them in the calling process (the
+        default is 1). The centers and their index are sent to every process once, when it starts
+    centers_index : spatial_index.CentersIndex, optional
+        The index of `centers_list`, it is built from `centers_list` if not given
+    drive_cache : drive_cache.DriveCache, optional
+        The cache of the parsed drives and their closest centers, unchanged drives are neither parsed nor assigned to
+        centers again (the default is not caching)
+
+    Returns
+    -------
+    List[(str, float, int, Exception)]
+        The output path, the seconds it took, the number of model rows and the raised exception (None if there was
+        none) of every drive, a failed drive does not stop the other drives from being generated
+    """
+    if centers_index is None:
+        centers_index = CentersIndex(centers_list)
+    if not os.path.exists(output_dir_path) and create:
+        os.makedirs(output_dir_path)
+    filenames = sorted(os.listdir(input_dir_path))
+    paths = [(os.path.join(input_dir_path, filename), os.path.join(output_dir_path, filename))
+             for filename in filenames]
+    results = []
+    start_time = time.perf_counter()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=__attach_worker_centers,
+                                 initargs=(centers_list, centers_index, drive_cache)) as executor:
+            futures = [executor.submit(__generate_drive_model_file, input_path, output_path)
+                       for input_path, output_path in paths]
+            # Waiting on the futures in submission order keeps the logs in the same order as the serial run
+            for (input_path, output_path), future in zip(paths, futures):
+                try:
+                    results.append((output_path,) + future.result() + (None,))
+                except Exception as e:
+                    results.append((output_path, 0.0, 0, e))
+                __print_drive_model_result(results[-1], print_logs)
+    else:
+        for input_path, output_path in paths:
+            try:
+                results.append((output_path,) + __generate_drive_model_file(input_path, output_path, centers_list,
+                                                                            centers_index, drive_cache) + (None,))
+            except Exception as e:
+                results.append((output_path, 0.0, 0, e))
+            __print_drive_model_result(results[-1], print_logs)
+    if print_logs:
+        elapsed = time.perf_counter() - start_time
+        print('Generated ' + str(sum(result[3] is None for result in results)) + ' of ' + str(len(results)) +
+              ' driving models in ' + '{:.3f}'.format(elapsed) + ' seconds, ' +
+              '{:.2f}'.format(len(results) / elapsed if elapsed else 0) + ' drives per second')
+    return results
+
+
+__worker_centers = {}
+
+
+def __attach_worker_centers(centers_list, centers_index, drive_cache):
+    __worker_centers['centers_list'] = centers_list
+    __worker_centers['centers_index'] = centers_index
+    __worker_centers['drive_cache'] = drive_cache
+
+
+def __generate_drive_model_file(input_path, output_path, centers_list=None, centers_index=None, drive_cache=None):
+    if centers_list is None:
+        centers_list = __worker_centers['centers_list']
+        centers_index = __worker_centers['centers_index']
+        drive_cache = __worker_centers['drive_cache']
+    start_time = time.perf_counter()
+    drive_model = generate_drive_model(input_path, centers_list, model_save_path=output_path,
+                                       centers_index=centers_index, drive_cache=drive_cache)
+    return time.perf_counter() - start_time, len(drive_model)
+
+
+def __print_drive_model_result(result, print_logs):
+    if not print_logs:
+        return
+    if result[3] is None:
+        print('finished Working on ' + result[0] + ' in ' + '{:.3f}'.format(result[1]) + ' seconds, ' +
+              str(result[2]) + ' model rows')
+    else:
+        print('failed Working on ' + result[0] + ': ' + repr(result[3]))
+
+
+def __generate_columns_for_processing(file_path, centers_list, centers_index=None, drive_cache=None):
+    """The time, speed and fuel consumption rate columns of a drive, the index of the closest center of every row, and
+    the representative rows, the first of the closest rows to each center, in the order they were read
+    """
+    if drive_cache is None:
+        columns = list(load_drive_columns(file_path).values())
+    else:
+        columns = list(drive_cache.load_drive_columns(file_path).values())
+    times = columns[0].astype(np.int64)
+    speeds = columns[3].astype(np.int64)
+    fcrs = columns[-1].astype(np.float64)
+    if not len(times):
+        return times, speeds, fcrs, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    if drive_cache is not None:
+        center_indexes, center_distances = drive_cache.closest_centers(file_path, centers_list, centers_index)
+    else:
+        if centers_index is None:
+            centers_index = CentersIndex(centers_list)
+        center_indexes, center_distances = centers_index.query(np.column_stack((columns[1], columns[2])))
+    # Group-wise argmin, sorting by center, then distance, then row puts the representative row first in its group
+    order = np.lexsort((np.arange(len(times)), center_distances, center_indexes))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = center_indexes[order][1:] != center_indexes[order][:-1]
+    return times, speeds, fcrs, center_indexes, np.sort(order[first])
+
+
+# change name to find cheapest path
+def cheapest_path_model(dir_path, store_dir_path=None, search_mode=SearchModes.DIJKSTRA.value, print_logs=False):
+    if is_graph_file(dir_path):
+        # A graph file saved by graph.save_graph_file() is mapped instead of parsed
+        graph = load_graph_file(dir_path)
+    elif store_dir_path is None:
+        graph = load_graph_from_dir(dir_path)
+    else:
+        # Only the files the store hasn't seen are read, the graph of the rest is loaded from the store
+        store = EcoRouteGraphStore(store_dir_path)
+        if store.add_dir(dir_path):
+            store.save()
+        graph = store.get_graph()
+    if search_mode == SearchModes.A_STAR.value:
+        cost_to, parents, expanded_count = graph.find_cheapest_path_a_star(END_ID, START_ID)
+        if print_logs:
+            print('Expanded ' + str(expanded_count) + ' of ' + str(graph.vertex_count()) + ' vertexes')
+    else:
+        cost_to, parents = graph.find_cheapest_paths(END_ID)
+    return_model = graph.cheapest_route(cost_to, parents)
 
     for line in return_model:
         print(line)
 
     return return_model
-
-
-def __load_driving_model_file(file_path, vertex_factory, connect_start=True, connect_end=True):
-    # the function builds the graph in reverse, if in the real world we went from a to b, in the graph we would be able
-    # to go from b to a and not from a to b
-    drive_model = load_driving_model_file(file_path)
-    if connect_start:
-        vertex_factory.get_vertex(drive_model[0][0], drive_model[0][1], drive_model[0][2]).add_neighbor(
-            vertex_factory.get_start(), 0)
-    for i in range(len(drive_model) - 1, 0, -1):
-        vertex_factory.get_vertex(drive_model[i][0], drive_model[i][1], drive_model[i][2] // 5 * 5).add_neighbor(
-            vertex_factory.get_vertex(drive_model[i - 1][0], drive_model[i - 1][1], drive_model[i - 1][2] // 5 * 5),
-            drive_model[i - 1][-1])
-    if connect_end:
-        vertex_factory.get_end().add_neighbor(
-            vertex_factory.get_vertex(drive_model[-1][0], drive_model[-1][1], drive_model[-1][2]), 0)
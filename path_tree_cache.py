@@ -0,0 +1,155 @@
+from collections import OrderedDict
+from numbers import Integral
+
+import numpy as np
+
+from graph import END_ID
+from graph import START_ID
+from spatial_index import CentersIndex
+
+DEFAULT_MAX_TREES = 8
+
+
+class ShortestPathTreeCache:
+    """Answers many cheapest route queries on one graph with a single search per destination
+
+    The graph is reversed, so one search from a destination finds the cheapest path from every vertex to it. The
+    resulting tree, the cost to the destination and the next vertex of every vertex, is kept, and a route from any start
+    vertex is then read off the tree in time proportional to its length. Trees are keyed by the destination and the
+    graph version, the least recently used tree is evicted once there are more than `max_trees` of them.
+
+    Parameters
+    ----------
+    graph : graph.EcoRouteGraph
+        The graph
+    max_trees : int, optional
+        The number of trees to keep (the default is DEFAULT_MAX_TREES)
+    """
+
+    def __init__(self, graph, max_trees=DEFAULT_MAX_TREES):
+        if max_trees < 1:
+            raise ValueError('max_trees must be at least 1')
+        self.max_trees = max_trees
+        self.trees = OrderedDict()
+        self.graph = None
+        self.set_graph(graph)
+
+    def set_graph(self, graph):
+        """Replaces the graph, the trees of any other graph version are dropped
+
+        Parameters
+        ----------
+        graph : graph.EcoRouteGraph
+            The new graph, a graph which was updated in place must get a new `version`
+        """
+        if self.graph is not graph or any(key[0] != graph.version for key in self.trees):
+            self.trees.clear()
+        self.graph = graph
+        self.__locations = None
+
+    def get_tree(self, destination=END_ID):
+        """The shortest path tree of a destination, searched for only if it isn't cached
+
+        Parameters
+        ----------
+        destination : Union[int, Tuple[int]]
+            The vertex id of the destination, or several vertex ids reaching any of which ends the route (the default is
+            the synthetic end vertex)
+
+        Returns
+        ----------
+        (numpy.ndarray, numpy.ndarray)
+            The cost from every vertex to the destination, inf where there is none, and the next vertex of every vertex
+            on its cheapest path to the destination, -1 for the destination and for vertexes with no path
+        """
+        if isinstance(destination, Integral):
+            destination = int(destination)
+        else:
+            destination = tuple(sorted(int(vertex_id) for vertex_id in destination))
+        key = (self.graph.version, destination)
+        if key in self.trees:
+            self.trees.move_to_end(key)
+        else:
+            self.trees[key] = self.graph.find_cheapest_paths(destination)
+            if len(self.trees) > self.max_trees:
+                self.trees.popitem(last=False)
+        return self.trees[key]
+
+    def route(self, start=START_ID, destination=END_ID):
+        """The cheapest route from a start vertex to a destination
+
+        Parameters
+        ----------
+        start : int
+            The vertex id of the start (the default is the synthetic start vertex)
+        destination : Union[int, Tuple[int]]
+            The destination, as `get_tree()` takes it (the default is the synthetic end vertex)
+
+        Returns
+        ----------
+        List[List[Union[float, int]]]
+            A driving model of the route from start to destination, without the synthetic vertexes, every row is
+            lat, lon, speed and the cost of the edge to the next row, 0 for the last row
+        """
+        cost_to, parents = self.get_tree(destination)
+        if not np.isfinite(cost_to[start]):
+            raise ValueError('There is no route from vertex ' + str(start) + ' to ' + str(destination))
+        route = []
+        current = start
+        while current != -1:
+            parent = parents[current].item()
+            if current > END_ID:
+                lat, lon, speed = self.graph.get_vertex(current)
+                route.append([lat, lon, speed, 0])
+            if parent != -1 and current > END_ID and parent > END_ID:
+                route[-1][3] = cost_to[current].item() - cost_to[parent].item()
+            current = parent
+        return route
+
+    def route_between_points(self, start_point, end_point):
+        """The cheapest route between the vertexes closest to two points, such as `util.FROM_HOME_START_TUPLE` and
+        `util.FROM_HOME_END_TUPLE`
+
+        All the vertexes at the location closest to the end point, one per speed, are the destination, and the start is
+        the cheapest of the vertexes at the location closest to the start point
+
+        Parameters
+        ----------
+        start_point : (float, float)
+            A latlong tuple
+        end_point : (float, float)
+            A latlong tuple
+
+        Returns
+        ----------
+        List[List[Union[float, int]]]
+            The route, as `route()` returns it
+        """
+        start_vertexes = self.vertexes_closest_to(start_point)
+        destination = tuple(self.vertexes_closest_to(end_point).tolist())
+        cost_to = self.get_tree(destination)[0]
+        return self.route(start_vertexes[np.argmin(cost_to[start_vertexes])].item(), destination)
+
+    def vertexes_closest_to(self, point):
+        """The real vertexes at the location closest to a point
+
+        Parameters
+        ----------
+        point : (float, float)
+            A latlong tuple
+
+        Returns
+        ----------
+        numpy.ndarray
+            Their vertex ids
+        """
+        if self.__locations is None:
+            if self.graph.vertex_count() <= END_ID + 1:
+                raise ValueError('The graph has no real vertexes')
+            locations, location_ids = np.unique(np.column_stack((self.graph.lats[END_ID + 1:],
+                                                                 self.graph.lons[END_ID + 1:])),
+                                                axis=0, return_inverse=True)
+            self.__locations = (CentersIndex(locations), location_ids.ravel())
+        locations_index, location_ids = self.__locations
+        location = locations_index.query([point])[0][0]
+        return np.flatnonzero(location_ids == location) + END_ID + 1
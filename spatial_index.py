@@ -0,0 +1,156 @@
+import numpy as np
+
+from geodesic import WGS84_FLATTENING
+from geodesic import WGS84_MAJOR_AXIS
+from geodesic import many_to_many
+from geodesic import paired_distances
+
+MIN_CELL_SIZE = 10  # m, keeps the cell coordinates inside the 21 bits each of them gets in a cell key
+CELL_KEY_OFFSET = 1 << 20
+DEFAULT_CELL_SIZE = 1000  # m, used when there are too few centers to estimate their spacing
+MAX_RING = 4  # Queries which are still unresolved after this ring fall back to a scan over all the centers
+RESOLVE_MARGIN = 0.01  # m, covers the difference between Vincenty's formula and the true geodesic
+QUERY_CHUNK_SIZE = 4096
+
+
+class CentersIndex:
+    """A uniform grid over the centers, in earth centered (ECEF) coordinates, for nearest center queries
+
+    A query searches the grid cells around its point ring after ring, and stops once no center in the next rings can be
+    closer than the closest center found. Since the geodesic between two points is never shorter than the straight
+    line between them, a ring `r` cells away bounds the geodesic distance of its centers from below, and the result is
+    exactly the one a linear scan over `centers_list` with `geodesic.point_to_points()` gives, including picking the
+    first of equally close centers.
+
+    Parameters
+    ----------
+    centers_list : List[(float, float)]
+        The latlong tuples of the centers
+    cell_size : float, optional
+        The side of a grid cell in meters (the default is the median distance between a center and its closest center)
+    """
+
+    def __init__(self, centers_list, cell_size=None):
+        if not len(centers_list):
+            raise ValueError('The centers list is empty')
+        self.centers_list = list(centers_list)
+        self.centers = np.asarray(self.centers_list, dtype=np.float64).reshape(-1, 2)
+        centers_xyz = self.__to_ecef(self.centers)
+        self.cell_size = max(float(cell_size) if cell_size else self.__estimate_cell_size(centers_xyz), MIN_CELL_SIZE)
+        keys = self.__to_cell_keys(np.floor(centers_xyz / self.cell_size).astype(np.int64))
+        # CSR layout, the centers of the cell `cell_keys[i]` are `center_order[cell_starts[i]:cell_starts[i + 1]]`
+        self.center_order = np.argsort(keys, kind='stable')
+        self.cell_keys, self.cell_starts = np.unique(keys[self.center_order], return_index=True)
+        self.cell_starts = np.append(self.cell_starts, len(keys))
+        self.ring_offsets = [self.__ring_offsets(r) for r in range(MAX_RING + 1)]
+
+    def query(self, points):
+        """Finds the closest center of every point
+
+        Parameters
+        ----------
+        points : Union[List[(float, float)], numpy.ndarray]
+            Latlong tuples, or an array of shape (n, 2)
+
+        Returns
+        ----------
+        (numpy.ndarray, numpy.ndarray)
+            The index in `centers_list` of the closest center of every point, and its distance in meters
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        center_indexes = np.empty(len(points), dtype=np.int64)
+        center_distances = np.empty(len(points), dtype=np.float64)
+        for start in range(0, len(points), QUERY_CHUNK_SIZE):
+            chunk = slice(start, start + QUERY_CHUNK_SIZE)
+            center_indexes[chunk], center_distances[chunk] = self.__query_chunk(points[chunk])
+        return center_indexes, center_distances
+
+    def query_centers(self, points):
+        """Finds the closest center of every point, as latlong tuples
+
+        Parameters
+        ----------
+        points : Union[List[(float, float)], numpy.ndarray]
+            Latlong tuples, or an array of shape (n, 2)
+
+        Returns
+        ----------
+        List[(float, float)]
+            The closest center of every point, the same objects `util.find_closest_center()` returns
+        """
+        return [self.centers_list[i] for i in self.query(points)[0]]
+
+    def __query_chunk(self, points):
+        cells = np.floor(self.__to_ecef(points) / self.cell_size).astype(np.int64)
+        best_indexes = np.full(len(points), len(self.centers), dtype=np.int64)
+        best_distances = np.full(len(points), np.inf)
+        unresolved = np.arange(len(points))
+        for r in range(MAX_RING + 1):
+            self.__search_ring(points, cells, unresolved, r, best_indexes, best_distances)
+            # Centers outside rings 0..r are more than r * cell_size meters away in a straight line
+            unresolved = unresolved[best_distances[unresolved] >= r * self.cell_size - RESOLVE_MARGIN]
+            if not len(unresolved):
+                break
+        if len(unresolved):
+            distances = many_to_many(points[unresolved], self.centers)
+            best_indexes[unresolved] = np.argmin(distances, axis=1)
+            best_distances[unresolved] = distances[np.arange(len(unresolved)), best_indexes[unresolved]]
+        return best_indexes, best_distances
+
+    def __search_ring(self, points, cells, queries, r, best_indexes, best_distances):
+        neighbor_keys = self.__to_cell_keys(cells[queries, None, :] + self.ring_offsets[r][None, :, :])
+        positions = np.minimum(np.searchsorted(self.cell_keys, neighbor_keys), len(self.cell_keys) - 1)
+        found = self.cell_keys[positions] == neighbor_keys
+        if not found.any():
+            return
+        cell_queries = np.broadcast_to(queries[:, None], neighbor_keys.shape)[found]
+        cell_positions = positions[found]
+        counts = self.cell_starts[cell_positions + 1] - self.cell_starts[cell_positions]
+        # Expand every (query, cell) pair into a (query, center) pair for each of the cell's centers
+        pair_queries = np.repeat(cell_queries, counts)
+        order_positions = np.repeat(self.cell_starts[cell_positions] - np.cumsum(counts) + counts, counts) + \
+            np.arange(counts.sum())
+        pair_centers = self.center_order[order_positions]
+        pair_distances = paired_distances(points[pair_queries], self.centers[pair_centers])
+        # The closest center of every query, the lowest index wins a tie
+        order = np.lexsort((pair_centers, pair_distances, pair_queries))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = pair_queries[order][1:] != pair_queries[order][:-1]
+        candidate_queries = pair_queries[order][first]
+        candidate_centers = pair_centers[order][first]
+        candidate_distances = pair_distances[order][first]
+        improved = (candidate_distances < best_distances[candidate_queries]) | \
+                   ((candidate_distances == best_distances[candidate_queries]) &
+                    (candidate_centers < best_indexes[candidate_queries]))
+        best_indexes[candidate_queries[improved]] = candidate_centers[improved]
+        best_distances[candidate_queries[improved]] = candidate_distances[improved]
+
+    @staticmethod
+    def __to_ecef(points):
+        lat = np.radians(points[:, 0])
+        lon = np.radians(points[:, 1])
+        e_sq = WGS84_FLATTENING * (2 - WGS84_FLATTENING)
+        n = WGS84_MAJOR_AXIS / np.sqrt(1 - e_sq * np.sin(lat) ** 2)
+        return np.column_stack((n * np.cos(lat) * np.cos(lon), n * np.cos(lat) * np.sin(lon),
+                                n * (1 - e_sq) * np.sin(lat)))
+
+    @staticmethod
+    def __to_cell_keys(cells):
+        cells = cells + CELL_KEY_OFFSET
+        return (cells[..., 0] << 42) | (cells[..., 1] << 21) | cells[..., 2]
+
+    @staticmethod
+    def __ring_offsets(r):
+        side = np.arange(-r, r + 1)
+        offsets = np.stack(np.meshgrid(side, side, side, indexing='ij'), axis=-1).reshape(-1, 3)
+        return offsets[np.abs(offsets).max(axis=1) == r].astype(np.int64)
+
+    @staticmethod
+    def __estimate_cell_size(centers_xyz):
+        if len(centers_xyz) < 2:
+            return DEFAULT_CELL_SIZE
+        sample = centers_xyz[np.linspace(0, len(centers_xyz) - 1, min(len(centers_xyz), 256)).astype(np.int64)]
+        distances = np.linalg.norm(sample[:, None, :] - centers_xyz[None, :, :], axis=2)
+        distances[distances == 0] = np.inf
+        closest = distances.min(axis=1)
+        return float(np.median(closest[np.isfinite(closest)])) if np.isfinite(closest).any() else DEFAULT_CELL_SIZE
@@ -1,6 +1,14 @@
+import hashlib
 from enum import Enum
 
-from geopy import distance
+import numpy as np
+
+from binary_drive import is_binary_drive_file
+from binary_drive import load_binary_drive_file
+from geodesic import DistanceModes
+from geodesic import consecutive_distances
+from geodesic import many_to_many
+from geodesic import point_to_points
 
 
 class OBDModes(Enum):
@@ -34,6 +42,8 @@ Headers = {
 R = 8.314  # J/K/mole
 MMAir = 28.97  # kgair/kmolair
 MILLIS_IN_HOUR = 3600000
+HASH_BLOCK_SIZE = 1 << 20  # Bytes read at a time by file_content_hash()
+BOUNDS_CHUNK_SIZE = 16384  # Drive rows per distance computation in get_drives_bounds_between_points()
 
 DEFAULT_VOLUMETRIC_EFFICIENCY = 80  # percent
 DEFAULT_ENGINE_DISPLACEMENT = 1999  # cm^3
@@ -109,42 +119,98 @@ def calculate_cost(time1, time2, fcr1, fcr2):
     return low * time_in_hours + ((high - low) * time_in_hours) / 2
 
 
+def calculate_segment_costs(times, fcrs):
+    """The cost of every segment between consecutive samples, `calculate_cost()` for all of them at once
+
+    Parameters
+    ----------
+    times : numpy.ndarray
+        The times of the samples in milliseconds
+    fcrs : numpy.ndarray
+        The fuel consumption rates of the samples
+
+    Returns
+    ----------
+    numpy.ndarray
+        n - 1 costs, the i-th is between sample i and sample i + 1, equal to the ones `calculate_cost()` gives
+    """
+    time_in_hours = np.abs(np.diff(times)) / MILLIS_IN_HOUR
+    high = np.maximum(fcrs[1:], fcrs[:-1])
+    low = np.minimum(fcrs[1:], fcrs[:-1])
+    return low * time_in_hours + ((high - low) * time_in_hours) / 2
+
+
 def calculate_route_length(gps_tuple_list):
-    sum1 = 0
-    for i in range(len(gps_tuple_list) - 1):
-        sum1 += distance.distance(gps_tuple_list[i], gps_tuple_list[i + 1]).km
-    return sum1
+    return float(consecutive_distances(gps_tuple_list).sum()) / 1000
 
 
 def get_drive_between_two_points(drive_matrix, start, end):
-    start_position = 0
-    closest_start = (float(drive_matrix[0][1]), float(drive_matrix[0][2]))
-    end_position = 0
-    closest_end = (float(drive_matrix[0][1]), float(drive_matrix[0][2]))
-    for i in range(1, len(drive_matrix)):
-        ctupple = (float(drive_matrix[i][1]), float(drive_matrix[i][2]))
-        if distance.distance(start, closest_start).m > distance.distance(start, ctupple).m:
-            start_position = i
-            closest_start = ctupple
-        if distance.distance(end, closest_end).m > distance.distance(end, ctupple).m:
-            end_position = i
-            closest_end = ctupple
+    start_position, end_position = get_drives_bounds_between_points([drive_matrix], [(start, end)])[0][0]
     return drive_matrix[start_position:end_position]
 
 
+def get_drives_bounds_between_points(drive_matrices, point_pairs, mode=DistanceModes.ELLIPSOIDAL.value):
+    """The slice bounds of the sections of many drives between several pairs of points, such as
+    (FROM_HOME_START_TUPLE, FROM_HOME_END_TUPLE) and (TO_HOME_START_TUPLE, TO_HOME_END_TUPLE)
+
+    Parameters
+    ----------
+    drive_matrices : Iterable[Union[List[List[str]], numpy.ndarray]]
+        Drive matrices, as loaded by `csv_util.load_drive_file()`, or arrays whose second and third columns are the
+        latitude and longitude
+    point_pairs : List[((float, float), (float, float))]
+        The start and end latlong tuples of every section
+    mode : DistanceModes enum value
+        The distance formula (the default is ELLIPSOIDAL)
+
+    Returns
+    ----------
+    List[List[(int, int)]]
+        For every drive, the start and end positions of every section, `drive_matrix[start:end]` is the section
+        `get_drive_between_two_points()` returns. The rows are not copied
+
+    Notes
+    --------
+    The distances from all the points of a drive to all the distinct section ends are computed in one pass
+    """
+    # A point may be any pair of numbers, like a list or an array row, as float tuples the equal ones are merged
+    point_pairs = [(tuple(map(float, start)), tuple(map(float, end))) for start, end in point_pairs]
+    ends = list(dict.fromkeys(point for point_pair in point_pairs for point in point_pair))
+    end_indexes = [(ends.index(start), ends.index(end)) for start, end in point_pairs]
+    bounds = []
+    for drive_matrix in drive_matrices:
+        if isinstance(drive_matrix, np.ndarray):
+            points = drive_matrix[:, 1:3].astype(np.float64)
+        else:
+            points = np.array([(float(row[1]), float(row[2])) for row in drive_matrix], dtype=np.float64).reshape(-1, 2)
+        if not len(points):
+            bounds.append([(0, 0)] * len(point_pairs))
+            continue
+        # Chunks of rows keep the intermediate arrays of many_to_many() small, the distances are the same
+        distances = np.empty((len(points), len(ends)))
+        for chunk_start in range(0, len(points), BOUNDS_CHUNK_SIZE):
+            distances[chunk_start:chunk_start + BOUNDS_CHUNK_SIZE] = many_to_many(
+                points[chunk_start:chunk_start + BOUNDS_CHUNK_SIZE], ends, mode=mode)
+        # argmin keeps the first of equally close points, like the strict comparison of a linear scan
+        closest = np.argmin(distances, axis=0).tolist()
+        bounds.append([(closest[start], closest[end]) for start, end in end_indexes])
+    return bounds
+
+
 def find_closest_center(lat, lon, master_list):
-    min_diff = -1
-    result_lat = 0
-    result_long = 0
-    for point in master_list:
-        if distance.distance(point, (lat, lon)).m < min_diff or min_diff == -1:
-            min_diff = distance.distance(point, (lat, lon)).m
-            result_lat = point[0]
-            result_long = point[1]
-    return result_lat, result_long
+    if len(master_list) == 0:
+        return 0, 0
+    closest = master_list[int(np.argmin(point_to_points((lat, lon), master_list)))]
+    return closest[0], closest[1]
 
 
 def calculate_csv_fuel_cost(input_path, has_headers=True):
+    if is_binary_drive_file(input_path):
+        drive = load_binary_drive_file(input_path)
+        if len(drive) < 2:
+            return 0
+        # The running sum adds the costs in the same order as the loop below
+        return np.cumsum(calculate_segment_costs(drive.column(0), drive.column(-1)))[-1].item()
     temp_matrix = []
     sum0 = 0
     with open(input_path, 'r') as file:
@@ -156,3 +222,23 @@ def calculate_csv_fuel_cost(input_path, has_headers=True):
     for i in range(len(temp_matrix) - 1):
         sum0 += calculate_cost(temp_matrix[i][0], temp_matrix[i + 1][0], temp_matrix[i][1], temp_matrix[i + 1][1])
     return sum0
+
+
+def file_content_hash(file_path):
+    """The SHA-256 hash of a file's content, as a hex string
+
+    Parameters
+    ----------
+    file_path : str
+        The file
+
+    Returns
+    ----------
+    str
+        The hash
+    """
+    content_hash = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+            content_hash.update(block)
+    return content_hash.hexdigest()
@@ -1,4 +1,6 @@
 class Vertex:
+    __slots__ = ('lat', 'lon', 'speed', 'cost_to', 'father_id', 'neighbors')
+
     def __init__(self, lat, lon, speed):
         self.lat = lat
         self.lon = lon
@@ -42,6 +44,8 @@ class Vertex:
 
 
 class VertexFactory:
+    __slots__ = ('vertex_dict',)
+
     def __init__(self):
         self.vertex_dict = {'start': Vertex(-200, -200, 0), 'end': Vertex(200, 200, 0)}
         self.vertex_dict['end'].cost_to = 0